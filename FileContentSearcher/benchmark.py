@@ -0,0 +1,324 @@
+"""Benchmarks for search.py on a generated corpus.
+
+Generates a deterministic tree of text files and xlsx workbooks, times
+search_files, check_file_conditions, find_match_locations and
+search_in_excel for several query shapes, and reports throughput and peak
+memory, optionally against a baseline saved by an earlier run.
+
+    python3 benchmark.py --save-baseline before.json
+    (change search.py)
+    python3 benchmark.py --baseline before.json
+"""
+import os
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+import search
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Corpus presets; every value can be overridden on the command line.
+SCALES = {
+    'small': dict(files=200, min_kb=1, max_kb=256, line_length=80, hit_density=0.01, workbooks=4, rows=2000),
+    'medium': dict(files=2000, min_kb=1, max_kb=1024, line_length=80, hit_density=0.01, workbooks=16, rows=5000),
+    'large': dict(files=10000, min_kb=1, max_kb=4096, line_length=120, hit_density=0.001, workbooks=32, rows=20000),
+}
+
+# Filler text, with some non-ASCII words so that decoding and case folding do real work.
+WORDS = ['info', 'debug', 'request', 'response', 'user', 'session', 'timeout', 'value', 'config',
+         'update', 'cache', 'worker', 'queue', 'status', 'payload', '処理', '完了', 'naïve', 'Straße']
+
+# The word that matching lines contain, and the one a few files contain to trip NOT patterns.
+HIT_WORD = 'needle'
+NOT_WORD = 'forbidden'
+
+QUERY_SHAPES = {
+    'literal': dict(and_patterns=[HIT_WORD]),
+    'literal-or-not': dict(or_patterns=[HIT_WORD, 'haystack'], not_patterns=[NOT_WORD]),
+    'ignore-case': dict(and_patterns=[HIT_WORD.upper()], ignore_case=True),
+    'regex': dict(and_patterns=[HIT_WORD + r'_\d{3}'], use_regex=True),
+    'regex-ignore-case': dict(and_patterns=[r'NEEDLE_\d+\s+\w+'], use_regex=True, ignore_case=True),
+}
+
+# Bytes of generated text searched in memory by the check/locate benchmarks.
+BUFFER_BYTES = 16 * 1024 * 1024
+
+def _line(rnd, length, hit):
+    words = []
+    size = 0
+    while size < length:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    if hit:
+        words.insert(rnd.randrange(len(words)), f"{HIT_WORD}_{rnd.randrange(1000):03d}")
+    return ' '.join(words)
+
+def _text(rnd, size, line_length, hit_density):
+    """Returns about size bytes of lines around line_length long, hit_density of them hits."""
+    lines = []
+    total = 0
+    while total < size:
+        line = _line(rnd, rnd.randint(line_length // 2, line_length * 3 // 2), rnd.random() < hit_density)
+        lines.append(line)
+        total += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines) + '\n'
+
+def _column_letter(index):
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _write_workbook(path, rnd, rows, hit_density):
+    """Writes a minimal xlsx file with one sheet of shared strings and numbers."""
+    strings = []
+    index = {}
+    sheet_rows = []
+    for row in range(1, rows + 1):
+        cells = []
+        for column in range(1, 6):
+            reference = f"{_column_letter(column)}{row}"
+            if column == 5:
+                cells.append(f'<c r="{reference}"><v>{rnd.randrange(100000)}</v></c>')
+                continue
+            text = _line(rnd, 20, rnd.random() < hit_density)
+            if text not in index:
+                index[text] = len(strings)
+                strings.append(text)
+            cells.append(f'<c r="{reference}" t="s"><v>{index[text]}</v></c>')
+        sheet_rows.append(f'<row r="{row}">{"".join(cells)}</row>')
+
+    main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    relationships = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    package = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '</Types>'))
+        archive.writestr('_rels/.rels', (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{package}">'
+            f'<Relationship Id="rId1" Type="{relationships}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        archive.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="{main}" xmlns:r="{relationships}">'
+            '<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{package}">'
+            f'<Relationship Id="rId1" Type="{relationships}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{relationships}/sharedStrings" Target="sharedStrings.xml"/>'
+            '</Relationships>'))
+        archive.writestr('xl/sharedStrings.xml', (
+            f'<?xml version="1.0" encoding="UTF-8"?><sst xmlns="{main}" count="{len(strings)}" uniqueCount="{len(strings)}">'
+            + ''.join(f'<si><t>{escape(text)}</t></si>' for text in strings) + '</sst>'))
+        archive.writestr('xl/worksheets/sheet1.xml', (
+            f'<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="{main}"><sheetData>'
+            + ''.join(sheet_rows) + '</sheetData></worksheet>'))
+
+def generate_corpus(root, seed=0, files=200, min_kb=1, max_kb=256, line_length=80, hit_density=0.01,
+                    workbooks=4, rows=2000):
+    """Writes a deterministic corpus under root: the same arguments always give the same bytes.
+
+    File sizes are spread log-uniformly between min_kb and max_kb. Each file's
+    share of matching lines varies around hit_density, a quarter of the files
+    have none at all and a few contain NOT_WORD. Workbooks go to root/xlsx.
+    """
+    rnd = random.Random(seed)
+    for i in range(files):
+        directory = os.path.join(root, 'text', f"d{i % 10}", f"s{i % 7}")
+        os.makedirs(directory, exist_ok=True)
+        size = int(1024 * min_kb * (max_kb / min_kb) ** rnd.random())
+        density = 0 if rnd.random() < 0.25 else hit_density * rnd.uniform(0.2, 2)
+        text = _text(rnd, size, line_length, density)
+        if rnd.random() < 0.05:
+            text += f"{NOT_WORD}\n"
+        with open(os.path.join(directory, f"f{i}.{rnd.choice(['log', 'txt', 'csv'])}"), 'w',
+                  encoding='utf-8', newline='\n') as f:
+            f.write(text)
+    if workbooks:
+        os.makedirs(os.path.join(root, 'xlsx'), exist_ok=True)
+    for i in range(workbooks):
+        _write_workbook(os.path.join(root, 'xlsx', f"book{i}.xlsx"), rnd, rows, hit_density)
+
+def _peak_rss_mb():
+    """Returns the peak resident set size of this process in MB, or None where unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def _tree_stats(root):
+    sizes = [os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(root) for name in names]
+    return len(sizes), sum(sizes)
+
+def _run_case(kind, root, shape, repeat):
+    """Times one benchmark case; runs in a fresh process so peak RSS is its own."""
+    query = search.SearchQuery(**QUERY_SHAPES[shape])
+    text_root = os.path.join(root, 'text')
+    xlsx_root = os.path.join(root, 'xlsx')
+    if kind == 'search_files':
+        files, size = _tree_stats(text_root)
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                search.search_files(text_root, [], [], query)
+    elif kind == 'search_in_excel':
+        paths = sorted(os.path.join(xlsx_root, name) for name in os.listdir(xlsx_root))
+        files, size = len(paths), sum(map(os.path.getsize, paths))
+        def run():
+            for path in paths:
+                search.search_in_excel(path, query)
+    else:
+        # The in-memory benchmarks use the text of the largest files, up to BUFFER_BYTES.
+        content = ''
+        for _, path in sorted(((os.path.getsize(os.path.join(d, n)), os.path.join(d, n))
+                               for d, _, names in os.walk(text_root) for n in names), reverse=True):
+            if len(content) >= BUFFER_BYTES:
+                break
+            with open(path, 'r', encoding='utf-8') as f:
+                content += f.read()
+        files, size = 1, len(content.encode('utf-8'))
+        function = search.check_file_conditions if kind == 'check_file_conditions' else search.find_match_locations
+        def run():
+            function(content, query)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {'seconds': best, 'mb_per_s': size / (1024 * 1024) / best, 'files_per_s': files / best,
+            'peak_rss_mb': _peak_rss_mb()}
+
+CASES = [(kind, shape) for kind in ('search_files', 'check_file_conditions', 'find_match_locations', 'search_in_excel')
+         for shape in QUERY_SHAPES]
+
+def run_benchmarks(root, repeat=3, cases=CASES):
+    """Runs each (kind, shape) case in its own process and returns {"kind/shape": measurements}."""
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for kind, shape in cases:
+        with context.Pool(1) as pool:
+            results[f"{kind}/{shape}"] = pool.apply(_run_case, (kind, root, shape, repeat))
+    return results
+
+def _change(value, baseline):
+    if value is None or not baseline:
+        return ''
+    return f"{(value / baseline - 1) * 100:+7.1f}%"
+
+def print_report(results, baseline=None):
+    """Prints a table of the results, with the change in MB/s and peak RSS against baseline."""
+    baseline = baseline or {}
+    print(f"{'case':<42} {'MB/s':>9} {'files/s':>10} {'RSS MB':>8}" + (f" {'MB/s vs base':>13} {'RSS vs base':>12}" if baseline else ''))
+    for case, result in results.items():
+        rss = result['peak_rss_mb']
+        line = f"{case:<42} {result['mb_per_s']:>9.1f} {result['files_per_s']:>10.1f} {'-' if rss is None else f'{rss:.0f}':>8}"
+        if baseline:
+            base = baseline.get(case)
+            if base is None:
+                line += f" {'(new)':>13}"
+            else:
+                line += f" {_change(result['mb_per_s'], base['mb_per_s']):>13} {_change(rss, base['peak_rss_mb']):>12}"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search.py on a generated corpus.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default='small', help="Corpus preset (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator (default: %(default)s).")
+    parser.add_argument("--files", type=int, help="Number of text files.")
+    parser.add_argument("--min-kb", type=int, help="Smallest text file size in KB.")
+    parser.add_argument("--max-kb", type=int, help="Largest text file size in KB.")
+    parser.add_argument("--line-length", type=int, help="Average line length in characters.")
+    parser.add_argument("--hit-density", type=float, help="Average share of lines that match.")
+    parser.add_argument("--workbooks", type=int, help="Number of xlsx workbooks.")
+    parser.add_argument("--rows", type=int, help="Rows per workbook.")
+    parser.add_argument("--corpus", metavar="DIR", help="Generate the corpus in DIR and keep it; an existing corpus generated with the same settings is reused.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is reported (default: %(default)s).")
+    parser.add_argument("--only", metavar="TEXT", help="Only run the cases whose name contains TEXT (e.g. 'search_files' or 'regex').")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against results saved with --save-baseline.")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Save the results to FILE.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON instead of a table.")
+    args = parser.parse_args()
+
+    settings = dict(SCALES[args.scale], seed=args.seed)
+    for key in ('files', 'min_kb', 'max_kb', 'line_length', 'hit_density', 'workbooks', 'rows'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    if settings['min_kb'] < 1 or settings['max_kb'] < settings['min_kb']:
+        print("Error: File sizes must satisfy 1 <= --min-kb <= --max-kb.")
+        exit(1)
+    if args.repeat < 1:
+        print("Error: --repeat must be at least 1.")
+        exit(1)
+    cases = [case for case in CASES if not args.only or args.only in '/'.join(case)]
+    if not settings['workbooks']:
+        cases = [case for case in cases if case[0] != 'search_in_excel']
+    if not cases:
+        print("Error: No benchmark cases selected.")
+        exit(1)
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot read baseline: {e}")
+            exit(1)
+        if saved.get('settings') != settings:
+            print("Warning: The baseline was measured on a corpus generated with other settings.", file=sys.stderr)
+        baseline = saved.get('results', {})
+
+    with contextlib.ExitStack() as stack:
+        if args.corpus:
+            root = args.corpus
+            marker = os.path.join(root, 'corpus.json')
+            try:
+                with open(marker, 'r', encoding='utf-8') as f:
+                    reuse = json.load(f) == settings
+            except (OSError, ValueError):
+                reuse = False
+            if not reuse:
+                if os.path.isdir(root) and os.listdir(root):
+                    print(f"Error: '{root}' is not empty and holds no corpus generated with these settings.")
+                    exit(1)
+                print(f"Generating corpus in '{root}'...", file=sys.stderr)
+                generate_corpus(root, **settings)
+                with open(marker, 'w', encoding='utf-8') as f:
+                    json.dump(settings, f)
+        else:
+            root = stack.enter_context(tempfile.TemporaryDirectory(prefix='fcs-bench-'))
+            print("Generating corpus...", file=sys.stderr)
+            generate_corpus(root, **settings)
+
+        files, size = _tree_stats(root)
+        print(f"Corpus: {files} files, {size / (1024 * 1024):.1f} MB", file=sys.stderr)
+        results = run_benchmarks(root, args.repeat, cases)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results, baseline)
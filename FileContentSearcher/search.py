@@ -1,167 +1,3330 @@
 import os
 import argparse
-import openpyxl
 import re
+import sys
 import fnmatch
+import bz2
+import contextlib
+import ctypes
+import errno
+import gzip
+import heapq
+import io
+import lzma
+import hashlib
+import mmap
+import multiprocessing
+import pickle
+import datetime
+import json
+import posixpath
+import select
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sqlite3
+import threading
+import time
+import traceback
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from bisect import bisect_right
+from itertools import accumulate
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def _search(pattern, content, use_regex, flags):
-    """Helper function to perform a single search."""
-    if use_regex:
-        return re.search(pattern, content, flags)
-    if (flags & re.IGNORECASE):
-        return pattern.lower() in content.lower()
-    return pattern in content
-
-def check_file_conditions(content, and_patterns, or_patterns, not_patterns, use_regex, ignore_case):
-    """Checks if the content satisfies all AND, OR, and NOT conditions."""
-    flags = re.IGNORECASE if ignore_case else 0
-    
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Line breaks other than \n recognised by str.splitlines().
+_OTHER_LINE_BREAK_CHARS = '\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+_OTHER_LINE_BREAKS = re.compile(f'[{_OTHER_LINE_BREAK_CHARS}]')
+
+# Characters read at a time when streaming text files, and the longest
+# match that may straddle two chunks before a file is read in one piece.
+CHUNK_SIZE = 1024 * 1024
+MAX_STREAM_OVERLAP = 64 * 1024
+# Lines longer than this are searched in pieces by literal queries, so that a
+# file without line breaks is not held in memory whole.
+MAX_LINE_CHARS = 4 * CHUNK_SIZE
+
+# Compressed single files searched by decompressing them on the fly, by
+# extension. Members of .zip archives are searched as separate files.
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Bytes read from the start of a file to tell whether it is binary, and the
+# leading bytes of binary formats that need not have a NUL byte that early.
+SNIFF_BYTES = 8192
+BINARY_MAGIC = (b'%PDF-', b'\x89PNG', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'SQLite format 3\x00', b'\x7fELF',
+                b'PK\x03\x04', b'\x1f\x8b', b'\xfd7zXZ\x00', b'7z\xbc\xaf\x27\x1c', b'Rar!\x1a\x07',
+                b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', b'\xca\xfe\xba\xbe', b'\xcf\xfa\xed\xfe', b'wOFF', b'wOF2')
+
+# Bytes of worksheet XML decompressed and parsed at a time.
+XLSX_READ_SIZE = 64 * 1024
+
+# Default upper bound for the --cache-dir workbook cache.
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+
+# Upper bound on the trigrams looked up in the index for a single pattern.
+MAX_QUERY_TRIGRAMS = 64
+
+# Lines holding a required literal are checked in windows of this many; once
+# they average fewer than DENSE_LITERAL_GAP characters apart, the regex scans
+# the text directly instead.
+LITERAL_WINDOW_LINES = 64
+DENSE_LITERAL_GAP = 256
+
+# How many files check_file_conditions sees between reorderings of its checks.
+REORDER_INTERVAL = 32
+
+# Bytes read at a time when hashing files for --dedup.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Bytes counted at a time when numbering lines of a memory-mapped file.
+COUNT_WINDOW = 16 * 1024 * 1024
+
+# Work units handed to each worker process in --jobs mode.
+BATCH_BYTES = 8 * 1024 * 1024
+BATCH_FILES = 256
+
+# Seconds between scans in --watch mode without inotify, and how long the
+# tree must be quiet after an inotify event before it is scanned.
+WATCH_INTERVAL = 2.0
+WATCH_SETTLE = 0.2
+
+# Compiled queries the search server keeps between requests, and the default
+# size of its in-memory cache of Excel text (used without --cache-dir).
+SERVE_QUERY_CACHE = 256
+SERVE_CACHE_BYTES = 256 * 1024 * 1024
+
+# In --jobs mode, text files of at least SPLIT_FILE_BYTES are searched by
+# several workers at once, in line-aligned ranges of about SPLIT_RANGE_BYTES.
+SPLIT_FILE_BYTES = 64 * 1024 * 1024
+SPLIT_RANGE_BYTES = 16 * 1024 * 1024
+
+# Files listed as the slowest in the --stats report, and files listed with
+# the reason they could not be searched.
+SLOWEST_FILES = 10
+MAX_ERROR_FILES = 20
+
+class SearchStats:
+    """Timings and counters of one search run, for --stats and --stats-json.
+
+    Phases are exclusive: while a nested phase runs, the one around it is
+    paused. Worker processes collect their own stats and send them back with
+    each result to be merged into those of the parent.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.files = 0
+        self.matched = 0
+        self.bytes = 0
+        self.skipped = {}
+        self.counters = {}
+        self.errors = {}
+        self.error_files = []
+        self.slowest = []
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Counts the time until the block exits as phase name."""
+        now = time.perf_counter()
+        if self._stack:
+            self._add(self._stack[-1], now)
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._add(self._stack.pop(), now)
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def _add(self, entry, now):
+        name, started = entry
+        self.phases[name] = self.phases.get(name, 0.0) + now - started
+
+    def search(self, filepath, search):
+        """Returns search(filepath), recording the time the file took and whether it matched."""
+        started = time.perf_counter()
+        with self.phase('other'):
+            locations = search(filepath)
+        self.record_file(filepath, time.perf_counter() - started, locations)
+        return locations
+
+    def record_file(self, filepath, seconds, matched):
+        self.files += 1
+        self.bytes += _file_size(filepath)
+        self.matched += bool(matched)
+        heapq.heappush(self.slowest, (seconds, filepath))
+        if len(self.slowest) > SLOWEST_FILES:
+            heapq.heappop(self.slowest)
+
+    def skip(self, reason, count=1):
+        self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+    def count(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def error(self, path, exception):
+        reason = type(exception).__name__
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+        if len(self.error_files) < MAX_ERROR_FILES:
+            self.error_files.append((path, f"{reason}: {exception}"))
+
+    def merge(self, other):
+        """Adds the stats collected by a worker process."""
+        for mine, theirs in ((self.phases, other.phases), (self.skipped, other.skipped),
+                             (self.counters, other.counters), (self.errors, other.errors)):
+            for key, value in theirs.items():
+                mine[key] = mine.get(key, 0) + value
+        self.files += other.files
+        self.matched += other.matched
+        self.bytes += other.bytes
+        self.error_files = (self.error_files + other.error_files)[:MAX_ERROR_FILES]
+        self.slowest = heapq.nsmallest(SLOWEST_FILES, self.slowest + other.slowest, key=lambda item: -item[0])
+        heapq.heapify(self.slowest)
+
+    def to_dict(self, wall_seconds):
+        """Returns the stats as the JSON-serialisable profile written by --stats-json."""
+        return {
+            "wall_seconds": wall_seconds,
+            "files": {"searched": self.files, "matched": self.matched, "bytes": self.bytes},
+            "phases": dict(sorted(self.phases.items(), key=lambda item: -item[1])),
+            "skipped": self.skipped,
+            "counters": self.counters,
+            "errors": {"by_reason": self.errors,
+                       "files": [{"path": path, "reason": reason} for path, reason in self.error_files]},
+            "slowest": [{"path": path, "seconds": seconds} for seconds, path in sorted(self.slowest, reverse=True)],
+        }
+
+    def report(self, wall_seconds, file=None):
+        """Prints a summary of the stats (to stderr by default)."""
+        file = file or sys.stderr
+        print("\n--- Search statistics ---", file=file)
+        print(f"Wall time: {wall_seconds:.3f} s", file=file)
+        print(f"Files searched: {self.files} ({self.matched} matched), {self.bytes / (1024 * 1024):.1f} MB", file=file)
+        for title, counts in (("Skipped", self.skipped), ("Other", self.counters), ("Errors", self.errors)):
+            if counts:
+                print(f"{title}: " + ", ".join(f"{name} {count}" for name, count in sorted(counts.items())), file=file)
+        for path, reason in self.error_files:
+            print(f"  {path}: {reason}", file=file)
+        total = sum(self.phases.values())
+        if total:
+            print("Time per phase (summed over worker processes):", file=file)
+            for name, seconds in sorted(self.phases.items(), key=lambda item: -item[1]):
+                print(f"  {name:<12} {seconds:9.3f} s {seconds / total:6.1%}", file=file)
+        if self.slowest:
+            print("Slowest files:", file=file)
+            for seconds, path in sorted(self.slowest, reverse=True):
+                print(f"  {seconds:9.3f} s  {path}", file=file)
+
+# The SearchStats of the current run, in each worker process as well; None
+# unless --stats or --stats-json was given, so the hooks below cost next to
+# nothing by default.
+_stats = None
+_NO_PHASE = contextlib.nullcontext()
+_DONE = object()
+
+def _phase(name):
+    """Returns a context manager timing phase name if stats are being collected."""
+    return _NO_PHASE if _stats is None else _stats.phase(name)
+
+def _timed(iterable, name):
+    """Returns iterable, counting the time spent producing its items as phase name if stats are being collected."""
+    return iterable if _stats is None else _timed_iter(iterable, name, _stats)
+
+def _timed_iter(iterable, name, stats):
+    iterator = iter(iterable)
     try:
-        if not_patterns:
-            for pattern in not_patterns:
-                if _search(pattern, content, use_regex, flags):
-                    return False
+        while True:
+            with stats.phase(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+def _record_error(path, exception):
+    if _stats is not None:
+        _stats.error(path, exception)
+
+def _skip(reason, count=1):
+    if _stats is not None:
+        _stats.skip(reason, count)
+
+def _count(name):
+    if _stats is not None:
+        _stats.count(name)
+
+def _alternation(parts):
+    """Joins regex sources (all str or all bytes) into one alternation."""
+    return (b'|' if parts and isinstance(parts[0], bytes) else '|').join(parts)
+
+class LiteralMatcher:
+    """Finds which of a set of literal patterns occur in a text in a single pass.
+
+    The patterns are compiled into one alternation. Each search resumes where
+    the previous hit started with the hit pattern removed, so overlapping
+    patterns are still found and the text is only scanned once.
+
+    With as_bytes the patterns are matched as UTF-8 against bytes-like content
+    (such as an mmap) that cannot be lowered, so case is ignored by the regex
+    engine instead, which like bytes.lower() only folds ASCII letters.
+    """
+
+    def __init__(self, patterns, ignore_case=False, as_bytes=False):
+        self.ignore_case = ignore_case
+        self.as_bytes = as_bytes
+        self.keys = frozenset(self.key(p) for p in patterns)
+
+    def key(self, pattern):
+        """Returns the form of pattern that is looked up in the (folded) text."""
+        if self.as_bytes:
+            pattern = pattern.encode('utf-8')
+        return pattern.lower() if self.ignore_case else pattern
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _compile(keys, flags=0):
+        return re.compile(_alternation([re.escape(k) for k in sorted(keys, key=len, reverse=True)]), flags)
+
+    def find(self, content, stop_keys=frozenset(), keys=None):
+        """Returns the set of keys (all of them, or those given) found in content.
+
+        Scanning ends early as soon as one of stop_keys is found.
+        """
+        flags = 0
+        if self.ignore_case and self.as_bytes:
+            flags = re.IGNORECASE
+        elif self.ignore_case:
+            content = content.lower()
+        found = set()
+        remaining = self.keys if keys is None else frozenset(keys)
+        pos = 0
+        while remaining:
+            match = self._compile(remaining, flags).search(content, pos)
+            if match is None:
+                break
+            key = match.group().lower() if flags else match.group()
+            found.add(key)
+            if key in stop_keys:
+                break
+            remaining = remaining - {key}
+            pos = match.start()
+        return found
+
+def _regex_ops(parsed):
+    """Yields every (opcode, argument) pair of a parsed regex, including nested ones."""
+    for op, av in parsed:
+        yield op, av
+        stack = [av]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, sre_parse.SubPattern):
+                yield from _regex_ops(item)
+            elif isinstance(item, (tuple, list)):
+                stack.extend(item)
+
+def _has_group_references(parsed):
+    """Returns True if a parsed regex refers to its own groups by number."""
+    return any(op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS) for op, _ in _regex_ops(parsed))
+
+def _is_line_local(parsed):
+    """Returns True if a parsed regex finds the same lines in a whole buffer as line by line.
+
+    With re.MULTILINE, ^ and $ behave like they do on a single line. String
+    anchors and negative lookarounds may see the neighbouring lines instead.
+    """
+    for op, av in _regex_ops(parsed):
+        if op is sre_parse.AT and av in (sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING):
+            return False
+        if op is sre_parse.ASSERT_NOT:
+            return False
+    return True
+
+def _can_match_newline(parsed):
+    """Returns True unless a parsed regex can be shown never to consume a \n."""
+    dotall = parsed.state.flags & re.DOTALL
+    for op, av in _regex_ops(parsed):
+        if op is sre_parse.LITERAL and av == 10:
+            return True
+        if op is sre_parse.NOT_LITERAL and av != 10:
+            return True
+        if op is sre_parse.ANY and dotall:
+            return True
+        if op is sre_parse.SUBPATTERN and av[1] & re.DOTALL:
+            return True
+        if op is sre_parse.IN and _set_contains_newline(av):
+            return True
+    return False
+
+def _set_contains_newline(items):
+    """Returns True if a parsed character set may contain \n."""
+    negate = contains = False
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = True
+        elif op is sre_parse.LITERAL:
+            contains |= av == 10
+        elif op is sre_parse.RANGE:
+            contains |= av[0] <= 10 <= av[1]
+        elif op is sre_parse.CATEGORY:
+            contains |= av not in (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_SPACE, sre_parse.CATEGORY_WORD)
+        else:
+            contains = True
+    return contains != negate
+
+def _stream_overlap(parsed):
+    """Returns how many characters a match of a parsed regex may straddle between chunks.
 
-        if and_patterns:
-            for pattern in and_patterns:
-                if not _search(pattern, content, use_regex, flags):
-                    return False
+    Chunks end on a line break, so a regex that never consumes a newline needs
+    no overlap at all; otherwise its width must be bounded. Returns None when
+    the regex can only be checked against the whole text: $ and \\Z would match
+    at the end of every chunk, and lookarounds may need text beyond it.
+    """
+    ops = list(_regex_ops(parsed))
+    if any(op is sre_parse.AT and av in (sre_parse.AT_END, sre_parse.AT_END_STRING, sre_parse.AT_NON_BOUNDARY)
+           for op, av in ops):
+        return None
+    if not _can_match_newline(parsed):
+        return 0
+    if any(op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) for op, _ in ops):
+        return None
+    width = parsed.getwidth()[1]
+    return width if width <= MAX_STREAM_OVERLAP else None
 
-        if or_patterns:
-            if not any(_search(pattern, content, use_regex, flags) for pattern in or_patterns):
+def _combine_patterns(patterns, flags):
+    """Compiles regex patterns into one alternation, or returns None if they cannot be merged.
+
+    Patterns using back-references would change meaning once their groups are
+    renumbered. Inline global flags such as (?i) apply to the whole regex, so a
+    pattern that sets any is kept apart even where Python accepts it mid-pattern.
+    """
+    if len(patterns) == 1:
+        return re.compile(patterns[0], flags)
+    parsed = [sre_parse.parse(p, flags) for p in patterns]
+    global_flags = sre_parse.parse(patterns[0][:0], flags).state.flags
+    if any(_has_group_references(p) or p.state.flags != global_flags for p in parsed):
+        return None
+    try:
+        if isinstance(patterns[0], bytes):
+            return re.compile(b'|'.join(b'(?:' + p + b')' for p in patterns), flags)
+        return re.compile('|'.join(f'(?:{p})' for p in patterns), flags)
+    except re.error:
+        return None
+
+def _required_literals(parsed, as_bytes=False):
+    """Returns strings (or bytes) that every match of a parsed regex contains.
+
+    Runs of literal characters are taken from the top-level sequence, from
+    groups without flags of their own and from repeats that occur at least once.
+    Case folding is not taken into account.
+    """
+    join = bytes if as_bytes else lambda run: ''.join(map(chr, run))
+    literals, run = [], []
+    for op, av in _flatten_groups(parsed):
+        if op is sre_parse.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            literals.append(join(run))
+            run = []
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            literals.extend(_required_literals(av[2], as_bytes))
+    if run:
+        literals.append(join(run))
+    return literals
+
+def _longest_required_literal(parsed, as_bytes=False):
+    """Returns the longest literal every match of a case-sensitive parsed regex contains, or None."""
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    return max(_required_literals(parsed, as_bytes), key=len, default=None)
+
+def _flatten_groups(parsed):
+    """Yields the items of a parsed regex with plain groups expanded in place."""
+    for op, av in parsed:
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            yield from _flatten_groups(av[3])
+        else:
+            yield op, av
+
+def _iter_near_literals(text, regex, literals, newline):
+    """Yields the first match of regex on each line that has one.
+
+    Every match must contain one of literals and fit on a single line, so the
+    regex only runs on lines where str.find (or bytes.find) sees a literal.
+    Where those lines turn out to be dense, the regex scans the rest directly.
+    """
+    found = {literal: text.find(literal) for literal in literals}
+    pos = window_start = 0
+    window_lines = 0
+    while True:
+        if window_lines == LITERAL_WINDOW_LINES:
+            if pos - window_start < LITERAL_WINDOW_LINES * DENSE_LITERAL_GAP:
+                break
+            window_start, window_lines = pos, 0
+        for literal, offset in found.items():
+            if offset != -1 and offset < pos:
+                found[literal] = text.find(literal, pos)
+        offset = min((offset for offset in found.values() if offset != -1), default=-1)
+        if offset == -1:
+            return
+        start = text.rfind(newline, 0, offset) + 1
+        end = text.find(newline, offset)
+        end = len(text) if end == -1 else end + 1
+        match = regex.search(text, start, end)
+        if match is not None:
+            yield match
+        pos = end
+        window_lines += 1
+    while True:
+        match = regex.search(text, pos)
+        if match is None:
+            return
+        yield match
+        end = text.find(newline, match.start())
+        if end == -1:
+            return
+        pos = end + 1
+
+class _AdaptiveOrder:
+    """A list of checks kept ordered by their observed cost per decisive outcome.
+
+    A check is decisive when it settles the result on its own: a failing
+    check in a chain that must all pass, or a hit in a chain where one hit is
+    enough. Cheap and often decisive checks move to the front, and checks that
+    have never run are tried first. The order only ever affects speed.
+    Safe to share between the search server's threads.
+    """
+
+    def __init__(self, checks):
+        self.checks = list(checks)
+        self._stats = {check: [0, 0, 0.0] for check in self.checks}
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Returns the checks in their current order, reordering them every REORDER_INTERVAL calls."""
+        with self._lock:
+            self._calls += 1
+            if self._calls % REORDER_INTERVAL == 0:
+                self.checks = sorted(self.checks, key=self._score)
+            return self.checks
+
+    def record(self, check, decisive, seconds):
+        with self._lock:
+            stats = self._stats[check]
+            stats[0] += 1
+            stats[1] += decisive
+            stats[2] += seconds
+
+    def _score(self, check):
+        runs, decisive, seconds = self._stats[check]
+        if not runs:
+            return 0.0
+        return (seconds / runs) * (runs + 2) / (decisive + 1)
+
+class SearchQuery:
+    """The AND/OR/NOT patterns of one search run, compiled once up front.
+
+    With as_bytes the patterns are compiled from their UTF-8 encoding and
+    applied to raw file bytes; text_query is then an equivalent str query for
+    content that has to be decoded anyway, such as Excel cells.
+
+    Raises re.error if use_regex is set and a pattern is not a valid regex.
+    """
+
+    def __init__(self, and_patterns=None, or_patterns=None, not_patterns=None, use_regex=False, ignore_case=False, as_bytes=False):
+        self.and_patterns = list(and_patterns or [])
+        self.or_patterns = list(or_patterns or [])
+        self.not_patterns = list(not_patterns or [])
+        self.use_regex = use_regex
+        self.ignore_case = ignore_case
+        self.as_bytes = as_bytes
+        self.flags = re.IGNORECASE if ignore_case else 0
+        self.positive_patterns = self.and_patterns + self.or_patterns
+        # Once one OR pattern has been found these need not be looked for any more.
+        self.or_only_patterns = frozenset(self.or_patterns) - set(self.and_patterns) - set(self.not_patterns)
+        self.text_query = SearchQuery(and_patterns, or_patterns, not_patterns, use_regex, ignore_case) if as_bytes else self
+
+        self.all_patterns = self.not_patterns + self.positive_patterns
+        all_patterns = self.all_patterns
+        source = {p: p.encode('utf-8') if as_bytes else p for p in all_patterns}
+        positive_sources = [source[p] for p in self.positive_patterns]
+        self.buffer_regex = None
+        self.buffer_regex_unfolded = None
+        self.required_literals = {}
+        self.line_literals = None
+        if use_regex:
+            self.literals = None
+            self.compiled = {p: re.compile(source[p], self.flags) for p in all_patterns}
+            parsed = {p: sre_parse.parse(source[p], self.flags) for p in all_patterns}
+            for p in all_patterns:
+                literal = _longest_required_literal(parsed[p], as_bytes)
+                if literal:
+                    self.required_literals[p] = literal
+            # Lines can be skipped unless they hold a literal some positive pattern needs.
+            if all(p in self.required_literals and not _can_match_newline(parsed[p]) for p in self.positive_patterns):
+                self.line_literals = sorted({self.required_literals[p] for p in self.positive_patterns})
+            self.location_regex = _combine_patterns(positive_sources, self.flags) if positive_sources else None
+            if positive_sources and all(_is_line_local(parsed[p]) for p in self.positive_patterns):
+                self.buffer_regex = _combine_patterns(positive_sources, self.flags | re.MULTILINE)
+            overlaps = [_stream_overlap(parsed[p]) for p in all_patterns]
+            # NOT and AND patterns are single checks; the OR patterns form one more.
+            self.check_order = _AdaptiveOrder([(False, p) for p in self.not_patterns] +
+                                              [(True, p) for p in self.and_patterns] +
+                                              ([(True, None)] if self.or_patterns else []))
+            self.or_order = _AdaptiveOrder(self.or_patterns)
+            self.hit_order = _AdaptiveOrder(dict.fromkeys(all_patterns))
+            self.stream_overlap = None if None in overlaps else max(overlaps, default=0)
+        else:
+            self.literals = LiteralMatcher(all_patterns, ignore_case, as_bytes)
+            self.compiled = None
+            # Literal lines are matched against line.lower() to keep str.lower() semantics.
+            keys = sorted({self.literals.key(p) for p in self.positive_patterns}, key=len, reverse=True)
+            self.location_regex = re.compile(_alternation([re.escape(k) for k in keys])) if keys else None
+            self.buffer_regex = self.location_regex
+            self.stream_overlap = max((len(k) for k in self.literals.keys), default=0)
+            if ignore_case and keys and as_bytes:
+                # Raw bytes are not lowered in place; their -i matches are ASCII-only, as with bytes.lower().
+                self.buffer_regex_unfolded = re.compile(_alternation([re.escape(p) for p in positive_sources]), re.IGNORECASE)
+
+    def fingerprint(self, max_count=None):
+        """Returns a digest identifying the results of this query, whatever the order of its patterns."""
+        spec = [sorted(self.and_patterns), sorted(self.or_patterns), sorted(self.not_patterns),
+                self.use_regex, self.ignore_case, self.as_bytes, max_count]
+        return hashlib.sha256(json.dumps(spec).encode('utf-8')).hexdigest()
+
+    def search(self, pattern, content, pos=0):
+        """Returns True if a single regex pattern occurs in content at or after pos.
+
+        Content lacking a literal the regex requires is rejected with a plain
+        find before the regex engine runs.
+        """
+        literal = self.required_literals.get(pattern)
+        if literal is not None and content.find(literal, pos) == -1:
+            return False
+        return self.compiled[pattern].search(content, pos) is not None
+
+    def find_hits(self, content, patterns, pos=0):
+        """Returns the subset of patterns that occur in content at or after pos.
+
+        Literal patterns are looked for in the whole of content. Regex patterns
+        are tried in adaptive order: the search stops at the first NOT hit,
+        since the content is rejected anyway, and once an OR pattern is found
+        the patterns in or_only_patterns are skipped. A missing AND pattern
+        settles nothing here, as content is often one chunk or cell of a file.
+        """
+        if self.literals is not None:
+            keys = {self.literals.key(p) for p in patterns}
+            found = self.literals.find(content, keys=keys)
+            return {p for p in patterns if self.literals.key(p) in found}
+        hits = set()
+        or_found = False
+        order = self.hit_order
+        for pattern in order.current():
+            if pattern not in patterns or (or_found and pattern in self.or_only_patterns):
+                continue
+            started = time.perf_counter()
+            found = self.search(pattern, content, pos)
+            rejects = found and pattern in self.not_patterns
+            settles = found and pattern in self.or_patterns
+            order.record(pattern, rejects or settles, time.perf_counter() - started)
+            if found:
+                hits.add(pattern)
+                if rejects:
+                    break
+                or_found = or_found or settles
+        return hits
+
+    def is_satisfied(self, hits):
+        """Returns True if the AND/OR conditions hold for the set of patterns found."""
+        if not all(p in hits for p in self.and_patterns):
+            return False
+        return not self.or_patterns or any(p in hits for p in self.or_patterns)
+
+    def matches_line(self, line):
+        """Returns True if any AND/OR pattern occurs in line."""
+        if self.location_regex is None:
+            if not self.use_regex:
                 return False
-        
-        return True
-    except re.error as e:
-        print(f"Regex error: {e}")
+            return any(self.search(p, line) for p in self.positive_patterns)
+        if self.line_literals is not None and all(line.find(literal) == -1 for literal in self.line_literals):
+            return False
+        if self.ignore_case and not self.use_regex:
+            line = line.lower()
+        return self.location_regex.search(line) is not None
+
+def _literal_conditions_hold(hits, query):
+    """Evaluates literal AND/OR/NOT conditions given the set of keys found."""
+    key = query.literals.key
+    if any(key(p) in hits for p in query.not_patterns):
+        return False
+    if not all(key(p) in hits for p in query.and_patterns):
+        return False
+    if query.or_patterns and not any(key(p) in hits for p in query.or_patterns):
         return False
+    return True
+
+def _check_literal_conditions(content, query):
+    """Evaluates literal AND/OR/NOT conditions from a single scan of content."""
+    matcher = query.literals
+    not_keys = frozenset(matcher.key(p) for p in query.not_patterns)
+    return _literal_conditions_hold(matcher.find(content, stop_keys=not_keys), query)
+
+def _any_or_pattern(content, query):
+    """Returns True if any OR pattern occurs in content, trying them in adaptive order."""
+    order = query.or_order
+    for pattern in order.current():
+        started = time.perf_counter()
+        found = query.search(pattern, content)
+        order.record(pattern, found, time.perf_counter() - started)
+        if found:
+            return True
+    return False
+
+def check_file_conditions(content, query):
+    """Checks if the content satisfies all AND, OR, and NOT conditions of query.
+
+    Regex checks run in an order adapted to their cost and to how often they
+    reject a file so far in the run, which does not change the result.
+    """
+    if not query.use_regex:
+        return _check_literal_conditions(content, query)
+
+    order = query.check_order
+    for check in order.current():
+        must_occur, pattern = check
+        started = time.perf_counter()
+        if pattern is None:
+            passed = _any_or_pattern(content, query)
+        else:
+            passed = query.search(pattern, content) == must_occur
+        order.record(check, not passed, time.perf_counter() - started)
+        if not passed:
+            return False
+    return True
+
+def _buffer_target(content, query):
+    """Returns the text and regex used to find candidate match offsets in content.
+
+    The text always has the same length as content so offsets map back to it.
+    The regex is None if the lines have to be checked one by one instead.
+    """
+    if query.as_bytes:
+        return content, query.buffer_regex_unfolded or query.buffer_regex
+    if not query.use_regex:
+        if not query.ignore_case:
+            return content, query.buffer_regex
+        folded = content.lower()
+        if len(folded) == len(content):
+            return folded, query.buffer_regex
+        # lower() changes the length of some characters (e.g. 'İ'), and re.IGNORECASE
+        # does not fold them the same way, so only lowering each line finds the same matches.
+        return content, None
 
-def find_match_locations(content_lines, patterns_to_find, use_regex, ignore_case):
-    """Finds all lines that match any of the given patterns and their content."""
+    # Turn every line break into \n so that ^ and $ (re.MULTILINE) see each line.
+    if '\r' in content:
+        content = content.replace('\r', '\n')
+    if _has_other_line_breaks(content):
+        content = _OTHER_LINE_BREAKS.sub('\n', content)
+    return content, query.buffer_regex
+
+def find_match_locations(content, query, max_count=None):
+    """Finds all lines that match any of the query's AND/OR patterns and their content.
+
+    Candidate matches are searched for in the whole buffer and mapped to line
+    numbers by bisecting the line start offsets, so the cost grows with the
+    number of matching lines rather than with the size of the file. With
+    max_count, only the first max_count matching lines are looked for.
+    """
     locations = {}
-    if not patterns_to_find:
+    if not query.positive_patterns or not content or max_count == 0:
         return locations
-        
-    flags = re.IGNORECASE if ignore_case else 0
-    
-    for i, line in enumerate(content_lines):
-        for pattern in patterns_to_find:
-            if _search(pattern, line, use_regex, flags):
+
+    if query.as_bytes:
+        return _find_byte_match_locations(content, query, max_count)
+
+    text, regex = _buffer_target(content, query) if query.buffer_regex is not None else (content, None)
+    if regex is None:
+        for i, line in enumerate(content.splitlines()):
+            if query.matches_line(line):
                 locations[i + 1] = line.strip()
+                if len(locations) == max_count:
+                    break
+        return locations
+
+    line_starts = [0, *accumulate(map(len, content.splitlines(True)))]
+    line_count = len(line_starts) - 1
+    if query.line_literals is not None:
+        matches = _iter_near_literals(text, regex, query.line_literals, '\n')
+    else:
+        matches = None
+    pos = 0
+    while True:
+        match = regex.search(text, pos) if matches is None else next(matches, None)
+        if match is None:
+            break
+        index = bisect_right(line_starts, match.start()) - 1
+        if index >= line_count:
+            break
+        start, pos = line_starts[index], line_starts[index + 1]
+        line = content[start:pos]
+        body = line.splitlines()[0]
+        # A match running into the next line does not count for this one.
+        if match.end() <= start + len(body) or query.matches_line(body):
+            locations[index + 1] = line.strip()
+            if len(locations) == max_count:
                 break
     return locations
 
-def search_in_excel(filepath, **kwargs):
-    """Extracts content from an Excel file and returns a dict of matching cells to their content."""
+def _count_newlines(buf, start, end):
+    """Counts the \n bytes in buf[start:end], copying at most COUNT_WINDOW bytes at a time."""
+    count = 0
+    while start < end:
+        stop = min(end, start + COUNT_WINDOW)
+        count += buf[start:stop].count(b'\n')
+        start = stop
+    return count
+
+def _find_byte_match_locations(buf, query, max_count=None):
+    """find_match_locations for raw bytes such as an mmap.
+
+    Lines end at \n, and only the lines reported are copied and decoded.
+    Line numbers are counted between consecutive hits instead of from a table
+    of line offsets, which would be as large as the file has lines.
+    """
+    locations = {}
+    _, regex = _buffer_target(buf, query)
+    size = len(buf)
+    line_number, counted = 1, 0
+    if regex is not None and query.line_literals is not None:
+        matches = _iter_near_literals(buf, regex, query.line_literals, b'\n')
+    else:
+        matches = None
+    pos = 0
+    while pos < size:
+        if regex is None:
+            start = pos
+            match = None
+        else:
+            match = regex.search(buf, pos) if matches is None else next(matches, None)
+            if match is None:
+                break
+            start = buf.rfind(b'\n', 0, match.start()) + 1
+        end = buf.find(b'\n', start)
+        if end == -1:
+            end = size
+        line_number += _count_newlines(buf, counted, start)
+        counted = start
+        line = buf[start:end]
+        # Without a buffer regex every line is checked on its own.
+        if (match is not None and match.end() <= end) or query.matches_line(line):
+            locations[line_number] = line.decode('utf-8', errors='ignore').strip()
+            if len(locations) == max_count:
+                break
+        pos = end + 1
+    return locations
+
+class _UnsupportedWorkbook(Exception):
+    """Raised by the built-in xlsx reader for content it leaves to openpyxl."""
+
+# Package relationship types, matched by suffix so that Strict OOXML works too.
+_REL_OFFICE_DOCUMENT = '/officeDocument'
+_REL_WORKSHEET = '/worksheet'
+_REL_SHARED_STRINGS = '/sharedStrings'
+_REL_STYLES = '/styles'
+
+# Number formats as classified by openpyxl: built-in ids that hold a date or
+# time, and the rules used for custom format codes.
+_BUILTIN_DATE_FORMATS = {14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47}
+_BUILTIN_TIMEDELTA_FORMATS = {46}
+_FORMAT_STRIP_RE = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+_FORMAT_DATE_RE = re.compile(r"(?<![_\\])[dmhysDMHYS]")
+_FORMAT_TIMEDELTA_RE = re.compile(r'\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?', re.I)
+
+_WINDOWS_EPOCH = datetime.datetime(1899, 12, 30)
+_MAC_EPOCH = datetime.datetime(1904, 1, 1)
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+def _read_relationships(archive, part):
+    """Returns {relationship id: (type, target part)} for a package part."""
+    folder, name = posixpath.split(part)
+    rels_part = posixpath.join(folder, '_rels', name + '.rels')
+    if rels_part not in archive.NameToInfo:
+        return {}
+    relationships = {}
+    for rel in ET.fromstring(archive.read(rels_part)):
+        target = rel.get('Target', '')
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(folder, target))
+        relationships[rel.get('Id')] = (rel.get('Type', ''), target)
+    return relationships
+
+def _find_relationship(relationships, rel_type):
+    for kind, target in relationships.values():
+        if kind.endswith(rel_type):
+            return target
+    return None
+
+def _rich_text(element):
+    """Returns the plain text of a <si> or <is> element, ignoring phonetic runs."""
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            for run_child in child:
+                if _local_name(run_child.tag) == 't':
+                    parts.append(run_child.text or '')
+    return ''.join(parts)
+
+def _read_shared_strings(archive, part):
+    strings = []
+    if part is None or part not in archive.NameToInfo:
+        return strings
+    with archive.open(part) as f:
+        for _, element in ET.iterparse(f):
+            if _local_name(element.tag) == 'si':
+                strings.append(_rich_text(element).replace('x005F_', ''))
+                element.clear()
+    return strings
+
+def _read_date_styles(archive, part):
+    """Returns the cell style indexes formatted as dates and as durations."""
+    date_styles, timedelta_styles = set(), set()
+    if part is None or part not in archive.NameToInfo:
+        return date_styles, timedelta_styles
+    root = ET.fromstring(archive.read(part))
+    custom = {}
+    cell_xfs = []
+    for element in root:
+        name = _local_name(element.tag)
+        if name == 'numFmts':
+            for fmt in element:
+                custom[int(fmt.get('numFmtId'))] = fmt.get('formatCode', '')
+        elif name == 'cellXfs':
+            cell_xfs = [int(xf.get('numFmtId', 0)) for xf in element]
+    for index, fmt_id in enumerate(cell_xfs):
+        if fmt_id in custom:
+            code = custom[fmt_id].split(';')[0]
+            if _FORMAT_DATE_RE.search(_FORMAT_STRIP_RE.sub('', code)):
+                date_styles.add(index)
+            if _FORMAT_TIMEDELTA_RE.search(code):
+                timedelta_styles.add(index)
+        else:
+            if fmt_id in _BUILTIN_DATE_FORMATS:
+                date_styles.add(index)
+            if fmt_id in _BUILTIN_TIMEDELTA_FORMATS:
+                timedelta_styles.add(index)
+    return date_styles, timedelta_styles
+
+def _from_excel(value, epoch, as_timedelta):
+    """Converts a serial date the way openpyxl does."""
+    if as_timedelta:
+        delta = datetime.timedelta(days=value)
+        if delta.microseconds:
+            delta = datetime.timedelta(seconds=delta.total_seconds() // 1, microseconds=round(delta.microseconds, -3))
+        return delta
+    day, fraction = divmod(value, 1)
+    diff = datetime.timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= value < 1 and diff.days == 0:
+        minutes, seconds = divmod(diff.seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return datetime.time(hours, minutes, seconds, diff.microseconds)
+    if 0 < value < 60 and epoch == _WINDOWS_EPOCH:
+        day += 1
+    return epoch + datetime.timedelta(days=day) + diff
+
+def _column_letter(index):
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index
+
+class _SheetReader:
+    """XMLParser target that turns worksheet XML into (coordinate, text) pairs.
+
+    Using a parser target instead of iterparse avoids building an element for
+    every cell; finished cells are collected in self.cells for the caller to
+    drain after each chunk fed to the parser.
+    """
+
+    def __init__(self, shared_strings, date_styles, timedelta_styles, epoch):
+        self.shared_strings = shared_strings
+        self.date_styles = date_styles
+        self.timedelta_styles = timedelta_styles
+        self.epoch = epoch
+        self.cells = []
+        self._names = {}
+        self._row = 0
+        self._column = 0
+        self._last_letters = ''
+        self._attrib = None
+        self._parts = None
+        self._value = self._formula = self._formula_type = self._inline = None
+        self._in_inline = self._in_phonetic = False
+
+    def start(self, tag, attrib):
+        name = self._names.get(tag) or self._names.setdefault(tag, _local_name(tag))
+        if name == 'c':
+            self._attrib = attrib
+            self._value = self._formula = self._formula_type = self._inline = None
+        elif name == 'v' or name == 'f' or (name == 't' and self._in_inline and not self._in_phonetic):
+            if name == 'f':
+                self._formula_type = attrib.get('t')
+            self._parts = []
+        elif name == 'is':
+            self._in_inline = True
+            self._inline = []
+        elif name == 'rPh':
+            self._in_phonetic = True
+        elif name == 'row':
+            self._row = int(attrib.get('r') or self._row + 1)
+            self._column = 0
+
+    def data(self, text):
+        if self._parts is not None:
+            self._parts.append(text)
+
+    def end(self, tag):
+        name = self._names[tag]
+        if name == 'c':
+            self._end_cell()
+        elif self._parts is not None and name in ('v', 'f', 't'):
+            text = ''.join(self._parts)
+            self._parts = None
+            if name == 'v':
+                self._value = text
+            elif name == 'f':
+                self._formula = text
+            else:
+                self._inline.append(text)
+        elif name == 'is':
+            self._in_inline = False
+        elif name == 'rPh':
+            self._in_phonetic = False
+
+    def close(self):
+        pass
+
+    def _end_cell(self):
+        reference = self._attrib.get('r')
+        if reference:
+            letters = reference.rstrip('0123456789')
+            self._column = None
+        else:
+            if self._column is None:
+                self._column = _column_index(self._last_letters)
+            self._column += 1
+            letters = _column_letter(self._column)
+        self._last_letters = letters
+        text = self._cell_text()
+        if text is not None:
+            self.cells.append((f"{letters}{self._row}", text))
+
+    def _cell_text(self):
+        """Returns str() of the value openpyxl would read for the cell, or None if empty."""
+        data_type = self._attrib.get('t', 'n')
+        if self._formula is not None:
+            if self._formula_type == 'shared' and not self._formula:
+                # Shared formulas have to be translated relative to their anchor.
+                raise _UnsupportedWorkbook('shared formula')
+            return '=' + self._formula
+        if data_type == 'inlineStr':
+            return None if self._inline is None else ''.join(self._inline)
+        value = self._value
+        if not value:
+            return None
+        if data_type == 'n':
+            number = float(value) if ('.' in value or 'E' in value or 'e' in value) else int(value)
+            style = int(self._attrib.get('s') or 0)
+            if style in self.date_styles:
+                try:
+                    return str(_from_excel(number, self.epoch, style in self.timedelta_styles))
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return str(number)
+        if data_type == 's':
+            return self.shared_strings[int(value)]
+        if data_type == 'b':
+            return str(bool(int(value)))
+        if data_type in ('str', 'e'):
+            return value
+        raise _UnsupportedWorkbook(f'cell type {data_type}')
+
+def _iter_sheet_cells(f, shared_strings, date_styles, timedelta_styles, epoch):
+    """Yields (coordinate, text) for the non-empty cells of a worksheet part."""
+    reader = _SheetReader(shared_strings, date_styles, timedelta_styles, epoch)
+    parser = ET.XMLParser(target=reader)
+    while True:
+        chunk = f.read(XLSX_READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from reader.cells
+        reader.cells.clear()
+    parser.close()
+    yield from reader.cells
+
+def _iter_xlsx_cells(filepath):
+    """Yields (sheet title, coordinate, text) for every non-empty cell of an xlsx file.
+
+    Reads the package directly with zipfile and incremental XML parsing,
+    producing the same text as openpyxl (formulas rather than their cached
+    values). Raises _UnsupportedWorkbook for content it cannot reproduce.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        workbook_part = _find_relationship(_read_relationships(archive, ''), _REL_OFFICE_DOCUMENT)
+        if workbook_part is None:
+            raise _UnsupportedWorkbook('no workbook part')
+        relationships = _read_relationships(archive, workbook_part)
+        shared_strings = _read_shared_strings(archive, _find_relationship(relationships, _REL_SHARED_STRINGS))
+        date_styles, timedelta_styles = _read_date_styles(archive, _find_relationship(relationships, _REL_STYLES))
+
+        epoch = _WINDOWS_EPOCH
+        sheets = []
+        for element in ET.fromstring(archive.read(workbook_part)):
+            name = _local_name(element.tag)
+            if name == 'workbookPr' and element.get('date1904') in ('1', 'true'):
+                epoch = _MAC_EPOCH
+            elif name == 'sheets':
+                for sheet in element:
+                    rel_id = next((v for k, v in sheet.attrib.items() if _local_name(k) == 'id'), None)
+                    kind, part = relationships.get(rel_id, ('', None))
+                    if kind.endswith(_REL_WORKSHEET) and part in archive.NameToInfo:
+                        sheets.append((sheet.get('name'), part))
+
+        for title, part in sheets:
+            with archive.open(part) as f:
+                for coordinate, text in _iter_sheet_cells(f, shared_strings, date_styles, timedelta_styles, epoch):
+                    yield title, coordinate, text
+
+def _iter_openpyxl_cells(filepath):
+    """Yields (sheet title, coordinate, text) for every non-empty cell, read through openpyxl."""
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    workbook = openpyxl.load_workbook(filepath, read_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for row_index, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                for column_index, value in enumerate(row, start=1):
+                    if value is not None:
+                        yield sheet.title, f"{get_column_letter(column_index)}{row_index}", str(value)
+    finally:
+        workbook.close()
+
+def _search_cells(cells, query, max_count=None):
+    """Evaluates the query over (sheet title, coordinate, text) cells in a single pass.
+
+    The AND/OR/NOT state is updated cell by cell while matching cells are
+    recorded, and everything is dropped as soon as a NOT pattern shows up.
+    Once max_count cells are recorded the rest are only checked for patterns,
+    and not read at all if there is nothing left to check.
+    """
+    pending = set(query.all_patterns)
+    hits = set()
+    locations = {}
+    for sheet_title, coordinate, text in cells:
+        if pending:
+            found = query.find_hits(text, pending)
+            if found:
+                if any(p in found for p in query.not_patterns):
+                    return {}
+                hits |= found
+                pending -= found
+                if any(p in found for p in query.or_patterns):
+                    pending -= query.or_only_patterns
+                if query.is_satisfied(hits):
+                    # A pattern can be both positive and NOT; only the NOT ones are left to look for.
+                    pending.intersection_update(query.not_patterns)
+        if len(locations) == max_count:
+            if not pending:
+                break
+        elif query.matches_line(text):
+            locations[f"{sheet_title}:{coordinate}"] = text
+    if not query.is_satisfied(hits):
+        return {}
+    return locations
+
+class _FileCache:
+    """On-disk SQLite cache of JSON data derived from files.
+
+    Entries are only used while the file's size and mtime are unchanged. Once
+    the stored data exceeds max_bytes the least recently used entries are
+    evicted. Every process and thread opens its own connection, so one cache
+    can be shared by the --jobs workers and the search server's threads.
+    """
+
+    FILENAME = None
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, self.FILENAME)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        # The pid check catches a connection inherited through fork.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+                    data BLOB, nbytes INTEGER, last_used REAL);
+                CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+                INSERT OR IGNORE INTO meta VALUES ('total_bytes', 0);
+            ''')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def _get(self, key, stat):
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT data FROM entries WHERE key = ? AND size = ? AND mtime_ns = ?',
+            (key, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def _put(self, key, stat, value):
+        data = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT nbytes FROM entries WHERE key = ?', (key,)).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, stat.st_size, stat.st_mtime_ns, data, len(data), time.time()))
+            connection.execute(
+                "UPDATE meta SET value = value + ? WHERE key = 'total_bytes'",
+                (len(data) - (row[0] if row else 0),))
+            self._evict(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+        while total > self.max_bytes:
+            oldest = connection.execute('SELECT key, nbytes FROM entries ORDER BY last_used LIMIT 64').fetchall()
+            if not oldest:
+                break
+            for key, nbytes in oldest:
+                connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= nbytes
+                if total <= self.max_bytes:
+                    break
+        connection.execute("UPDATE meta SET value = ? WHERE key = 'total_bytes'", (max(total, 0),))
+
+class WorkbookCache(_FileCache):
+    """Cache of the cell text extracted from xlsx files, keyed by absolute path."""
+
+    FILENAME = 'xlsx_cells.sqlite3'
+
+    def get(self, filepath, stat):
+        """Returns the cached [sheet title, coordinate, text] cells of filepath, or None."""
+        return self._get(os.path.abspath(filepath), stat)
+
+    def put(self, filepath, stat, cells):
+        """Stores the cells of filepath as of stat, evicting old entries if needed."""
+        self._put(os.path.abspath(filepath), stat, cells)
+
+class ResultCache(_FileCache):
+    """Cache of per-file search results for one query, for --cache-results.
+
+    Entries are keyed by the query's fingerprint and the file's absolute path,
+    so reruns of the same query only search files that changed.
+    """
+
+    FILENAME = 'results.sqlite3'
+
+    def __init__(self, directory, query, max_count=None, max_bytes=DEFAULT_CACHE_BYTES):
+        super().__init__(directory, max_bytes)
+        self.fingerprint = query.fingerprint(max_count)
+
+    def get(self, filepath, stat):
+        """Returns the cached locations dict of filepath, or None."""
+        pairs = self._get(f"{self.fingerprint}:{os.path.abspath(filepath)}", stat)
+        return None if pairs is None else dict(pairs)
+
+    def put(self, filepath, stat, locations):
+        """Stores the locations found in filepath as of stat."""
+        self._put(f"{self.fingerprint}:{os.path.abspath(filepath)}", stat, list(locations.items()))
+
+def _read_workbook_cells(filepath):
+    """Returns all cells of a workbook, falling back to openpyxl if needed."""
     try:
-        workbook = openpyxl.load_workbook(filepath, read_only=True)
-        
-        # Pass 1: Check conditions on the whole file content
-        full_content_list = [str(cell.value) for sheet in workbook.worksheets for row in sheet.iter_rows() for cell in row if cell.value is not None]
-        full_content_str = "\n".join(full_content_list)
-        if not check_file_conditions(full_content_str, **kwargs):
+        return list(_iter_xlsx_cells(filepath))
+    except Exception:
+        return list(_iter_openpyxl_cells(filepath))
+
+def _cached_workbook_cells(filepath, cache):
+    """Returns all cells of a workbook through a WorkbookCache."""
+    stat = os.stat(filepath)
+    cells = cache.get(filepath, stat)
+    if cells is None:
+        cells = _read_workbook_cells(filepath)
+        cache.put(filepath, stat, cells)
+    return cells
+
+def search_in_excel(filepath, query, cache=None, max_count=None):
+    """Extracts content from an Excel file and returns a dict of matching cells to their content.
+
+    Conditions are evaluated per cell, so a pattern cannot span two cells.
+    Workbooks are read with the built-in xlsx reader; openpyxl is only used
+    (and imported) for workbooks the reader cannot handle. With a
+    WorkbookCache, unchanged workbooks are not read at all.
+    """
+    if cache is not None:
+        try:
+            with _phase('xlsx_load'):
+                cells = _cached_workbook_cells(filepath, cache)
+            with _phase('conditions'):
+                return _search_cells(cells, query, max_count)
+        except Exception as e:
+            _record_error(filepath, e)
             return {}
+    try:
+        with _phase('conditions'):
+            return _search_cells(_timed(_iter_xlsx_cells(filepath), 'xlsx_load'), query, max_count)
+    except Exception:
+        _count('openpyxl_fallbacks')
+    try:
+        with _phase('conditions'):
+            return _search_cells(_timed(_iter_openpyxl_cells(filepath), 'xlsx_load'), query, max_count)
+    except Exception as e:
+        _record_error(filepath, e)
+        return {}
+
+def _read_chunks(f, chunk_size=CHUNK_SIZE, line_overlap=None, max_line=MAX_LINE_CHARS):
+    """Yields the text of f in pieces of about chunk_size that end on a line break.
+
+    Only the last piece may end mid-line. A single line longer than chunk_size
+    is kept whole, unless line_overlap is given and it is longer than
+    max_line: the line is then cut into pieces of about max_line characters
+    that each start with the last line_overlap characters of the piece
+    before, so that every match of up to line_overlap + 1 characters lies
+    whole in one of them.
+    """
+    carry = ''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        data = carry + data
+        cut = data.rfind('\n') + 1
+        if not cut:
+            # A trailing \r may still be followed by \n in the next piece.
+            cut = data.rfind('\r', 0, len(data) - 1) + 1
+        if cut:
+            yield data[:cut]
+            carry = data[cut:]
+        elif line_overlap is not None and len(data) > max_line + line_overlap:
+            piece = data[:-1] if data.endswith('\r') else data
+            yield piece
+            carry = data[len(piece) - line_overlap:]
+        else:
+            carry = data
+
+def _ends_line(text):
+    """Returns True if text ends with a line break, as str.splitlines() sees it."""
+    return text.endswith(('\n', '\r')) or _OTHER_LINE_BREAKS.match(text[-1:]) is not None
+
+def _has_other_line_breaks(text):
+    """Returns True if text holds a line break other than \\n or \\r; much faster than _OTHER_LINE_BREAKS.search."""
+    return any(char in text for char in _OTHER_LINE_BREAK_CHARS)
+
+def _count_lines(text):
+    """Returns len(text.splitlines()) without building the list in the common case."""
+    if '\r' in text or _has_other_line_breaks(text):
+        return len(text.splitlines())
+    return text.count('\n') + (0 if not text or text.endswith('\n') else 1)
 
-        # Pass 2: Find locations and their content
-        locations = {}
-        positive_patterns = (kwargs.get('and_patterns') or []) + (kwargs.get('or_patterns') or [])
-        if not positive_patterns:
+def _search_text_stream(f, query, max_count=None):
+    """Searches an open text file chunk by chunk in a single pass, keeping memory bounded.
+
+    The AND/OR/NOT state is updated chunk by chunk while matching lines are
+    recorded, and everything is dropped as soon as a NOT pattern shows up.
+    Lines are only looked for once a positive pattern has been seen, and the
+    rest of the file is not read once max_count lines are recorded and no
+    NOT patterns are left to check. For literal queries, lines longer than
+    MAX_LINE_CHARS are searched in overlapping pieces (see _read_chunks) and
+    reported with the piece the match was found in.
+    """
+    tail_size = query.stream_overlap + 1
+    line_overlap = query.stream_overlap if query.literals is not None else None
+    pending = set(query.all_patterns)
+    hits = set()
+    locations = {}
+    line_offset = 0
+    previous = None
+    tail = ''
+    for chunk in _timed(_read_chunks(f, line_overlap=line_overlap), 'read'):
+        if previous is not None:
+            # Counted only once another chunk follows, so a file read in one chunk is never counted.
+            # The last line of a piece cut from a long line goes on in the next piece.
+            line_offset += _count_lines(previous) - (0 if _ends_line(previous) else 1)
+        previous = chunk
+        if pending:
+            window = tail + chunk
+            with _phase('conditions'):
+                found = query.find_hits(window, pending, 1 if tail else 0)
+            tail = window[-tail_size:]
+            if found:
+                if any(p in found for p in query.not_patterns):
+                    return {}
+                hits |= found
+                pending -= found
+                if any(p in found for p in query.or_patterns):
+                    pending -= query.or_only_patterns
+                if query.is_satisfied(hits):
+                    # A pattern can be both positive and NOT; only the NOT ones are left to look for.
+                    pending.intersection_update(query.not_patterns)
+        if len(locations) == max_count:
+            if not pending:
+                break
+        elif hits:
+            limit = None if max_count is None else max_count - len(locations)
+            with _phase('locations'):
+                chunk_locations = find_match_locations(chunk, query, limit)
+            for line, text in chunk_locations.items():
+                # A piece of a long line starts with the end of the piece before.
+                locations.setdefault(line + line_offset, text)
+    if not query.is_satisfied(hits):
+        return {}
+    return locations
+
+def _search_text_file(f, query, max_count=None):
+    """Searches an open text file, streaming it unless the query needs all of it at once."""
+    if query.stream_overlap is not None and query.positive_patterns:
+        return _search_text_stream(f, query, max_count)
+    with _phase('read'):
+        content = f.read()
+    with _phase('conditions'):
+        if not check_file_conditions(content, query):
             return {}
+    with _phase('locations'):
+        return find_match_locations(content, query, max_count)
 
-        flags = re.IGNORECASE if kwargs.get('ignore_case') else 0
+def _is_archive(filepath):
+    """Returns True for a zip archive or a compressed file."""
+    return filepath.endswith(('.zip', *COMPRESSED_OPENERS))
 
-        for sheet in workbook.worksheets:
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if cell.value is not None:
-                        cell_content = str(cell.value)
-                        if any(_search(p, cell_content, kwargs.get('use_regex'), flags) for p in positive_patterns):
-                            locations[f"{sheet.title}:{cell.coordinate}"] = cell_content
-        return locations
-    except Exception:
+def _iter_streams(filepath, skip_binary=False):
+    """Yields (member, file) for the text of a file, decompressing archives as streams.
+
+    member is the name of a zip archive member, or None for any other file.
+    Members that cannot be opened, such as encrypted ones, are skipped, and
+    with skip_binary so are those whose decompressed start looks binary. Each
+    file is closed when the next one is requested.
+    """
+    if filepath.endswith('.zip'):
+        with zipfile.ZipFile(filepath) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                try:
+                    raw = archive.open(info)
+                except (RuntimeError, NotImplementedError, zipfile.BadZipFile):
+                    continue
+                with raw:
+                    if skip_binary and _stream_looks_binary(raw):
+                        _skip('binary')
+                        continue
+                    with io.TextIOWrapper(raw, encoding='utf-8', errors='ignore') as f:
+                        yield info.filename, f
+        return
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filepath)[1], open)
+    with opener(filepath, 'rb') as raw:
+        if skip_binary and _stream_looks_binary(raw):
+            _skip('binary')
+            return
+        with io.TextIOWrapper(raw, encoding='utf-8', errors='ignore') as f:
+            yield None, f
+
+def _stream_looks_binary(raw):
+    """Applies the _looks_binary check to the start of a binary stream, then rewinds it."""
+    block = raw.read(SNIFF_BYTES)
+    raw.seek(0)
+    return _is_binary_block(block)
+
+def search_in_archive(filepath, query, max_count=None, skip_binary=False):
+    """Searches a compressed file or each member of a zip archive without extracting it to disk.
+
+    Members are searched as separate files and their locations are given as
+    "member:line"; iter_search_files reports them as archive!member. With
+    skip_binary, members that look binary are left out.
+    """
+    locations = {}
+    try:
+        for member, f in _iter_streams(filepath, skip_binary):
+            for line, text in _search_text_file(f, query, max_count).items():
+                locations[line if member is None else f"{member}:{line}"] = text
+    except Exception as e:
+        _record_error(filepath, e)
         return {}
+    return locations
+
+def _archive_members(filepath, locations, batch=False):
+    """Splits the "member:line" locations of a zip archive into (archive!member, locations) pairs.
+
+    With batch, locations maps query names to such locations, as for a QueryBatch.
+    """
+    members = {}
+    for name, query_locations in (locations.items() if batch else [(None, locations)]):
+        for location, text in query_locations.items():
+            member, _, line = location.rpartition(':')
+            member_locations = members.setdefault(member, {})
+            if batch:
+                member_locations = member_locations.setdefault(name, {})
+            member_locations[int(line)] = text
+    return [(f"{filepath}!{member}", member_locations) for member, member_locations in members.items()]
 
-def search_in_text(filepath, **kwargs):
-    """Extracts content from a text file and returns a dict of matching lines to their content."""
+def search_in_bytes(filepath, query, max_count=None):
+    """Searches the raw bytes of a text file through mmap and returns a dict of matching lines.
+
+    Nothing is decoded except the lines that are reported.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return {}
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                with _phase('conditions'):
+                    if not check_file_conditions(buf, query):
+                        return {}
+                with _phase('locations'):
+                    return find_match_locations(buf, query, max_count)
+    except Exception as e:
+        _record_error(filepath, e)
+        return {}
+
+def search_in_text(filepath, query, max_count=None):
+    """Extracts content from a text file and returns a dict of matching lines to their content.
+
+    Files are streamed in chunks unless a regex may match text of unbounded
+    length across lines, in which case the whole file is read at once.
+    """
     try:
         with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        
-        if not check_file_conditions(content, **kwargs):
+            return _search_text_file(f, query, max_count)
+    except Exception as e:
+        _record_error(filepath, e)
+        return {}
+
+class QueryBatch:
+    """Several named queries evaluated together, for --queries.
+
+    Each file is read (and decoded, or its workbook parsed) once for all of
+    them, and the literal patterns of all queries with the same case handling
+    are looked for in a single shared scan.
+    """
+
+    def __init__(self, queries, as_bytes=False):
+        self.queries = dict(queries)
+        self.as_bytes = as_bytes
+        # Decoded text (workbooks, archives) is searched with the str versions of the queries.
+        self.text_batch = QueryBatch({name: q.text_query for name, q in self.queries.items()}) if as_bytes else self
+        self._matchers = {}
+        for ignore_case in (False, True):
+            patterns = {p for q in self.queries.values() if not q.use_regex and q.ignore_case == ignore_case
+                        for p in q.all_patterns}
+            if patterns:
+                self._matchers[ignore_case] = LiteralMatcher(sorted(patterns), ignore_case, as_bytes)
+
+    def _search_content(self, content, max_count):
+        with _phase('conditions'):
+            hits = {ignore_case: matcher.find(content) for ignore_case, matcher in self._matchers.items()}
+        results = {}
+        for name, query in self.queries.items():
+            with _phase('conditions'):
+                if query.use_regex:
+                    satisfied = check_file_conditions(content, query)
+                else:
+                    satisfied = _literal_conditions_hold(hits[query.ignore_case], query)
+            if satisfied:
+                with _phase('locations'):
+                    results[name] = find_match_locations(content, query, max_count)
+        return results
+
+    def search_file(self, filepath, cache=None, max_count=None, skip_binary=False):
+        """Searches one file for every query and returns {name: locations} for those that match.
+
+        skip_binary leaves out archive members that look binary, as for search_in_archive.
+        """
+        try:
+            if filepath.endswith('.xlsx'):
+                with _phase('xlsx_load'):
+                    if cache is not None:
+                        cells = _cached_workbook_cells(filepath, cache)
+                    else:
+                        cells = _read_workbook_cells(filepath)
+                with _phase('conditions'):
+                    results = {name: _search_cells(cells, query.text_query, max_count)
+                               for name, query in self.queries.items()}
+            elif _is_archive(filepath):
+                results = {}
+                for member, f in _iter_streams(filepath, skip_binary):
+                    with _phase('read'):
+                        content = f.read()
+                    for name, locations in self.text_batch._search_content(content, max_count).items():
+                        for line, text in locations.items():
+                            key = line if member is None else f"{member}:{line}"
+                            results.setdefault(name, {})[key] = text
+            elif self.as_bytes:
+                with open(filepath, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return {}
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                        results = self._search_content(buf, max_count)
+            else:
+                with _phase('read'), open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+                    content = f.read()
+                results = self._search_content(content, max_count)
+        except Exception as e:
+            _record_error(filepath, e)
             return {}
-            
-        positive_patterns = (kwargs.get('and_patterns') or []) + (kwargs.get('or_patterns') or [])
-        return find_match_locations(content.splitlines(), positive_patterns, kwargs.get('use_regex'), kwargs.get('ignore_case'))
+        return {name: locations for name, locations in results.items() if locations}
+
+def load_queries(filepath, use_regex=False, ignore_case=False, as_bytes=False):
+    """Reads named queries from a JSON file into a QueryBatch.
+
+    The file maps each name to an object with "and", "or" and "not" pattern
+    lists and optional "regex" and "ignore_case" flags, which default to
+    use_regex and ignore_case. Raises ValueError for a malformed file and
+    re.error for an invalid regular expression.
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        try:
+            specs = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not valid JSON: {e}") from None
+    return _parse_queries(specs, use_regex, ignore_case, as_bytes)
+
+def _parse_queries(specs, use_regex=False, ignore_case=False, as_bytes=False):
+    """Builds a QueryBatch from the decoded contents of a queries file (see load_queries)."""
+    if not isinstance(specs, dict) or not specs:
+        raise ValueError("expected a non-empty object mapping query names to queries")
+    queries = {name: _parse_query(spec, use_regex, ignore_case, as_bytes, f"query '{name}'")
+               for name, spec in specs.items()}
+    return QueryBatch(queries, as_bytes)
+
+def _parse_query(spec, use_regex=False, ignore_case=False, as_bytes=False, label="query"):
+    """Builds a SearchQuery from one query object of a queries file; label names it in ValueError messages."""
+    if not isinstance(spec, dict) or set(spec) - {"and", "or", "not", "regex", "ignore_case"}:
+        raise ValueError(f"{label} must be an object with and/or/not/regex/ignore_case keys")
+    patterns = [spec.get(key) or [] for key in ("and", "or", "not")]
+    if not all(isinstance(group, list) and all(isinstance(p, str) for p in group) for group in patterns):
+        raise ValueError(f"{label}: and/or/not must be lists of strings")
+    if not (patterns[0] or patterns[1]):
+        raise ValueError(f"{label} needs at least one 'and' or 'or' pattern")
+    return SearchQuery(*patterns, use_regex=bool(spec.get("regex", use_regex)),
+                       ignore_case=bool(spec.get("ignore_case", ignore_case)), as_bytes=as_bytes)
+
+def _parse_size(text):
+    """Parses a size such as 500, 64K, 10M or 2G (powers of 1024) into bytes. Raises ValueError."""
+    match = re.fullmatch(r'(\d+)([KMG]?)B?', text.strip().upper())
+    if match is None:
+        raise ValueError(f"invalid size '{text}'")
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' ')
+
+def _looks_binary(filepath):
+    """Returns True if the first block of a file holds a NUL byte or starts like a known binary format."""
+    try:
+        with open(filepath, 'rb') as f:
+            block = f.read(SNIFF_BYTES)
+    except OSError:
+        # Left to the search, which reports the error.
+        return False
+    return _is_binary_block(block)
+
+def _is_binary_block(block):
+    return b'\x00' in block or block.startswith(BINARY_MAGIC)
+
+class FilePolicy:
+    """Decides which files are worth searching, for --max-filesize, --binary-files and --type-policy.
+
+    rules are (glob, action) pairs tried in order against the file name. The
+    action is 'skip', 'text' (search without sniffing), 'sniff' (the default
+    for other files) or a size limit in bytes for that type, which replaces
+    max_filesize and sniffs as well. Sniffed files that look binary are
+    skipped if skip_binary is set. Excel files are binary by design and never
+    sniffed; archives are not either, but their members are as they are searched.
+    """
+
+    ACTIONS = ('skip', 'text', 'sniff')
+
+    def __init__(self, max_filesize=None, skip_binary=True, rules=()):
+        self.max_filesize = max_filesize
+        self.skip_binary = skip_binary
+        self.rules = [(re.compile(fnmatch.translate(os.path.normcase(glob))), action) for glob, action in rules]
+
+    @classmethod
+    def parse_rules(cls, text):
+        """Parses 'GLOB=ACTION,...' (e.g. '*.pdf=skip,*.csv=50M') into rules. Raises ValueError."""
+        rules = []
+        for item in text.split(','):
+            glob, sep, action = item.rpartition('=')
+            if not sep or not glob:
+                raise ValueError(f"expected GLOB=ACTION, got '{item}'")
+            action = action.strip().lower()
+            if action not in cls.ACTIONS:
+                try:
+                    action = _parse_size(action)
+                except ValueError:
+                    raise ValueError(f"'{item}': the action must be skip, text, sniff or a size") from None
+            rules.append((glob.strip(), action))
+        return rules
+
+    def _action(self, filepath):
+        name = os.path.normcase(os.path.basename(filepath))
+        for regex, action in self.rules:
+            if regex.match(name):
+                return action
+        return 'sniff'
+
+    def allows(self, filepath):
+        """Returns True if filepath should be searched, counting the reason for --stats if not."""
+        action = self._action(filepath)
+        if action == 'skip':
+            _skip('type_policy')
+            return False
+        limit = action if isinstance(action, int) else self.max_filesize
+        if limit is not None and _file_size(filepath) > limit:
+            _skip('too_large')
+            return False
+        if (action != 'text' and self.skip_binary and not filepath.endswith('.xlsx')
+                and not _is_archive(filepath) and _looks_binary(filepath)):
+            _skip('binary')
+            return False
+        return True
+
+    def sniffs(self, filepath):
+        """Returns True if filepath, or each member of it if it is an archive, is skipped when it looks binary."""
+        return self.skip_binary and self._action(filepath) != 'text'
+
+def _compile_globs(patterns):
+    """Compiles fnmatch-style patterns into a single regex matching any of them, or None."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(os.path.normcase(p)) for p in patterns))
+
+def _passes_filters(name, include_re, exclude_re):
+    name = os.path.normcase(name)
+    if include_re is not None and not include_re.match(name):
+        return False
+    return exclude_re is None or not exclude_re.match(name)
+
+def _glob_segment_regex(segment):
+    """Translates one path segment of a gitignore pattern into a regex."""
+    parts = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        i += 1
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '\\' and i < len(segment):
+            parts.append(re.escape(segment[i]))
+            i += 1
+        elif c == '[':
+            # A ']' right after '[' or '[!' belongs to the set.
+            end = segment.find(']', i + 2 if segment[i:i + 1] in ('!', '^') else i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+                continue
+            body = segment[i:end]
+            if body[:1] == '!':
+                body = '^' + body[1:]
+            parts.append('[' + body + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+def _parse_ignore_line(line):
+    """Parses one line of a .gitignore-style file into (regex, negate, dir_only), or None."""
+    line = line.rstrip('\n\r')
+    if not line.endswith('\\ '):
+        line = line.rstrip(' ')
+    if not line or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith('\\#') or line.startswith('\\!'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    segments = line.lstrip('/').split('/')
+    regex = '' if anchored else '(?:.*/)?'
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            regex += '.*' if last else '(?:[^/]*/)*'
+        else:
+            regex += _glob_segment_regex(segment) + ('' if last else '/')
+    return re.compile(regex, re.DOTALL), negate, dir_only
+
+def _read_ignore_rules(dirpath, prefix, ignore_files):
+    """Returns the rules of the ignore files in dirpath, in the order they apply.
+
+    Each rule is (prefix length, regex, negate, dir_only); rules are matched
+    against paths relative to the walk root, starting after the prefix.
+    """
+    rules = []
+    for name in ignore_files:
+        try:
+            with open(os.path.join(dirpath, name), 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            rule = _parse_ignore_line(line)
+            if rule is not None:
+                rules.append((len(prefix),) + rule)
+    return rules
+
+def _is_ignored(rules, relpath, is_dir):
+    """Returns True if the last ignore rule matching relpath excludes it."""
+    for start, regex, negate, dir_only in reversed(rules):
+        if dir_only and not is_dir:
+            continue
+        if regex.fullmatch(relpath, start):
+            return not negate
+    return False
+
+def _walk_files(directory, exclude_dir_re=None, ignore_files=()):
+    """Yields the files under directory in os.walk order, using os.scandir.
+
+    Directories whose name matches exclude_dir_re or that are excluded by one
+    of the ignore_files (e.g. .gitignore) are pruned without being read.
+    Symbolic links to directories are not followed.
+    """
+    stack = [(directory, '', [])]
+    while stack:
+        dirpath, prefix, rules = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError as e:
+            _record_error(dirpath, e)
+            continue
+        if ignore_files:
+            rules = rules + _read_ignore_rules(dirpath, prefix, ignore_files)
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if rules and _is_ignored(rules, prefix + entry.name, is_dir):
+                continue
+            if not is_dir:
+                yield entry.path, entry.name
+            elif exclude_dir_re is not None and exclude_dir_re.match(os.path.normcase(entry.name)):
+                continue
+            elif not entry.is_symlink():
+                subdirs.append((entry.path, prefix + entry.name + '/', rules))
+        stack.extend(reversed(subdirs))
+
+def _collect_files(directory, include_list, exclude_list, exclude_dirs=(), ignore_files=()):
+    """Yields the paths under directory that pass the include/exclude filters.
+
+    exclude_dirs are name patterns of directories to skip entirely, and
+    ignore_files names of .gitignore-style files honoured in every directory.
+    """
+    include_re = _compile_globs(include_list)
+    exclude_re = _compile_globs(exclude_list)
+    for filepath, name in _walk_files(directory, _compile_globs(exclude_dirs), ignore_files):
+        if _passes_filters(name, include_re, exclude_re):
+            yield filepath
+
+def _read_file_list(f, include_list, exclude_list):
+    """Yields the paths listed one per line in f that pass the include/exclude filters."""
+    include_re = _compile_globs(include_list)
+    exclude_re = _compile_globs(exclude_list)
+    for line in f:
+        filepath = line.rstrip('\r\n')
+        if filepath and _passes_filters(os.path.basename(filepath), include_re, exclude_re):
+            yield filepath
+
+# Folding applied to both indexed text and query trigrams, so that one index
+# serves case-sensitive and -i searches alike: ASCII case, plus the non-ASCII
+# characters that str.lower() or re.IGNORECASE equate with an ASCII letter.
+_TRIGRAM_FOLD = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ\u0130\u0131\u017f\u212a',
+                              'abcdefghijklmnopqrstuvwxyziisk')
+
+def _trigrams(text):
+    """Returns the set of folded three-character substrings of text."""
+    text = text.translate(_TRIGRAM_FOLD)
+    return set(map(''.join, set(zip(text, text[1:], text[2:]))))
+
+def _file_trigrams(filepath, cache=None):
+    """Returns the trigrams of a file's searchable text, or None if it cannot be read.
+
+    Excel files contribute the trigrams of each cell separately, and zip
+    archives those of each member.
+    """
+    trigrams = set()
+    try:
+        if filepath.endswith('.xlsx'):
+            cells = _cached_workbook_cells(filepath, cache) if cache is not None else _read_workbook_cells(filepath)
+            for _, _, text in cells:
+                trigrams |= _trigrams(text)
+            return trigrams
+        for _, f in _iter_streams(filepath):
+            tail = ''
+            for chunk in _read_chunks(f):
+                text = tail + chunk
+                trigrams |= _trigrams(text)
+                tail = text[-2:]
+        return trigrams
     except Exception:
+        return None
+
+def _pattern_trigrams(pattern, query):
+    """Returns trigrams that any text matching pattern must contain.
+
+    With case folding only ASCII trigrams are kept, as other characters may
+    match in ways the index folding does not cover.
+    """
+    if query.use_regex:
+        parsed = sre_parse.parse(pattern, query.flags)
+        ignore_case = parsed.state.flags & re.IGNORECASE
+        literals = _required_literals(parsed)
+    else:
+        ignore_case = query.ignore_case
+        literals = [pattern]
+    trigrams = set()
+    for literal in literals:
+        trigrams |= _trigrams(literal)
+    if ignore_case:
+        trigrams = {t for t in trigrams if t.isascii()}
+    return sorted(trigrams)[:MAX_QUERY_TRIGRAMS]
+
+class TrigramIndex:
+    """Persistent SQLite index mapping folded trigrams to the files containing them.
+
+    The index only narrows down which files need to be searched: files that
+    are missing from it or changed since it was updated are always searched,
+    and every candidate is still checked with the normal search.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER);
+                CREATE TABLE IF NOT EXISTS postings (
+                    trigram TEXT, file_id INTEGER, PRIMARY KEY (trigram, file_id)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+            ''')
+            self._connection = connection
+        return self._connection
+
+    def update(self, directory, include_list, exclude_list, cache=None, exclude_dirs=(), ignore_files=()):
+        """Indexes new and changed files under directory and forgets deleted ones.
+
+        Returns the number of files indexed and the number removed.
+        """
+        connection = self._connect()
+        root = os.path.join(os.path.abspath(directory), '')
+        known = {path: (file_id, size, mtime_ns) for path, file_id, size, mtime_ns in connection.execute(
+            'SELECT path, id, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?', (len(root), root))}
+        seen = set()
+        indexed = 0
+        for filepath in _collect_files(directory, include_list, exclude_list, exclude_dirs, ignore_files):
+            key = os.path.abspath(filepath)
+            seen.add(key)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            entry = known.get(key)
+            if entry is not None and entry[1:] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            trigrams = _file_trigrams(filepath, cache)
+            if entry is not None:
+                self._remove(connection, entry[0])
+            if trigrams is not None:
+                file_id = connection.execute('INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)',
+                                             (key, stat.st_size, stat.st_mtime_ns)).lastrowid
+                connection.executemany('INSERT INTO postings VALUES (?, ?)', ((t, file_id) for t in trigrams))
+                indexed += 1
+            connection.commit()
+        removed = [entry[0] for path, entry in known.items() if path not in seen]
+        for file_id in removed:
+            self._remove(connection, file_id)
+        connection.commit()
+        return indexed, len(removed)
+
+    @staticmethod
+    def _remove(connection, file_id):
+        connection.execute('DELETE FROM postings WHERE file_id = ?', (file_id,))
+        connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def _files_with(self, trigrams):
+        """Returns the ids of the files containing every trigram."""
+        placeholders = ','.join('?' * len(trigrams))
+        rows = self._connect().execute(
+            f'SELECT file_id FROM postings WHERE trigram IN ({placeholders}) GROUP BY file_id HAVING COUNT(*) = ?',
+            (*trigrams, len(trigrams)))
+        return {file_id for file_id, in rows}
+
+    def _matching_ids(self, query):
+        """Returns the ids of the indexed files that may satisfy query, or None for all of them."""
+        def candidates(pattern):
+            trigrams = _pattern_trigrams(pattern, query)
+            return self._files_with(trigrams) if trigrams else None
+
+        allowed = None
+        for pattern in query.and_patterns:
+            found = candidates(pattern)
+            if found is not None:
+                allowed = found if allowed is None else allowed & found
+        if query.or_patterns:
+            found = [candidates(pattern) for pattern in query.or_patterns]
+            if None not in found:
+                union = set().union(*found)
+                allowed = union if allowed is None else allowed & union
+        return allowed
+
+    def candidates(self, filepaths, query):
+        """Yields the filepaths that may satisfy query according to the index.
+
+        In bytes mode only Excel files and archives are narrowed down, since
+        the index is built from decoded text.
+        """
+        if isinstance(query, QueryBatch):
+            found = [self._matching_ids(q.text_query) for q in query.queries.values()]
+            allowed = None if None in found else set().union(*found)
+        else:
+            allowed = self._matching_ids(query.text_query)
+        if allowed is None:
+            yield from filepaths
+            return
+        entries = {path: (file_id, size, mtime_ns) for path, file_id, size, mtime_ns in
+                   self._connect().execute('SELECT path, id, size, mtime_ns FROM files')}
+        for filepath in filepaths:
+            entry = entries.get(os.path.abspath(filepath))
+            if entry is None or entry[0] in allowed or (query.as_bytes and not filepath.endswith('.xlsx')
+                                                          and not _is_archive(filepath)):
+                yield filepath
+                continue
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            if entry[1:] != (stat.st_size, stat.st_mtime_ns):
+                yield filepath
+            else:
+                _skip('index')
+
+def _search_file(filepath, query, cache=None, max_count=None, result_cache=None, policy=None):
+    """Searches a single file, dispatching on its type.
+
+    With a ResultCache, the stored result is returned if the file is unchanged.
+    A QueryBatch returns the locations for each of its matching queries by name.
+    The FilePolicy, if any, decides whether archive members that look binary
+    are skipped; the file itself is expected to have passed it already.
+    """
+    if result_cache is not None:
+        try:
+            stat = os.stat(filepath)
+            locations = result_cache.get(filepath, stat)
+        except (OSError, sqlite3.Error):
+            return _search_file(filepath, query, cache, max_count, policy=policy)
+        if locations is not None:
+            _count('result_cache_hits')
+        else:
+            locations = _search_file(filepath, query, cache, max_count, policy=policy)
+            try:
+                result_cache.put(filepath, stat, locations)
+            except sqlite3.Error:
+                pass
+        return locations
+    skip_binary = policy is not None and _is_archive(filepath) and policy.sniffs(filepath)
+    if isinstance(query, QueryBatch):
+        return query.search_file(filepath, cache, max_count, skip_binary)
+    if filepath.endswith('.xlsx'):
+        return search_in_excel(filepath, query.text_query, cache, max_count)
+    if _is_archive(filepath):
+        return search_in_archive(filepath, query.text_query, max_count, skip_binary)
+    if query.as_bytes:
+        return search_in_bytes(filepath, query, max_count)
+    return search_in_text(filepath, query, max_count)
+
+# The settings of the current run, installed once in each worker process
+# (or per task in a pool shared between searches, see _run_task).
+# _worker_stop is set by the parent once it needs no more results.
+_worker_query = None
+_worker_cache = None
+_worker_max_count = None
+_worker_result_cache = None
+_worker_policy = None
+_worker_stop = None
+_worker_settings = None
+
+def _init_worker(query, cache, max_count, result_cache, policy, stop, collect_stats=False):
+    global _worker_stop
+    _worker_stop = stop
+    _configure_worker(query, cache, max_count, result_cache, policy, collect_stats)
+
+def _configure_worker(query, cache, max_count, result_cache, policy, collect_stats=False):
+    global _worker_query, _worker_cache, _worker_max_count, _worker_result_cache, _worker_policy, _stats
+    _worker_query = query
+    _worker_cache = cache
+    _worker_max_count = max_count
+    _worker_result_cache = result_cache
+    _worker_policy = policy
+    _stats = SearchStats() if collect_stats else None
+
+def _run_task(settings, task, *args):
+    """Worker entry point for a pool shared between searches: runs task with the settings of its search.
+
+    settings holds the pickled _configure_worker arguments. They are only
+    unpickled when they differ from the previous task's, so a worker keeps
+    its compiled query for as long as the same search keeps it busy.
+    """
+    global _worker_settings
+    if settings != _worker_settings:
+        _configure_worker(*pickle.loads(settings))
+        _worker_settings = settings
+    return task(*args)
+
+def _take_worker_stats():
+    """Returns the stats a worker collected since the last call (None if not collecting) and starts over."""
+    global _stats
+    if _stats is None:
+        return None
+    stats, _stats = _stats, SearchStats()
+    return stats
+
+def _search_batch(filepaths):
+    """Worker entry point: searches a batch of files and returns the matching ones and the stats."""
+    search = partial(_search_file, query=_worker_query, cache=_worker_cache, max_count=_worker_max_count,
+                     result_cache=_worker_result_cache, policy=_worker_policy)
+    if _stats is not None:
+        search = partial(_stats.search, search=search)
+    results = []
+    for filepath in filepaths:
+        if _worker_stop.is_set():
+            break
+        if _worker_policy is not None and not _worker_policy.allows(filepath):
+            continue
+        locations = search(filepath)
+        if locations:
+            results.append((filepath, locations))
+    return results, _take_worker_stats()
+
+def _decode_lines(data):
+    """Decodes UTF-8 bytes with universal newlines, as search_in_text reads files."""
+    return data.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+def _search_range(filepath, start, end):
+    """Worker entry point: searches the lines in bytes start to end of a large text file.
+
+    Returns the patterns found, the match locations numbered from the start
+    of the range and the number of lines in it, or None if the range could
+    not be searched, along with the worker's stats. The text just before the
+    range is searched for patterns as well, like the overlap between chunks
+    in _search_text_stream.
+    """
+    with _phase('other'):
+        part = _scan_range(filepath, start, end)
+    return part, _take_worker_stats()
+
+def _scan_range(filepath, start, end):
+    query = _worker_query
+    if _worker_stop.is_set():
+        return None
+    try:
+        with _phase('read'), open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            overlap = query.stream_overlap + 1
+            if query.as_bytes:
+                head = buf[max(0, start - overlap):start]
+                chunk = buf[start:end]
+                line_count = chunk.count(b'\n')
+            else:
+                # A character takes at most four bytes in UTF-8. Line breaks are
+                # translated like open() does in text mode.
+                head = _decode_lines(buf[max(0, start - 4 * overlap):start])[-overlap:]
+                chunk = _decode_lines(buf[start:end])
+                line_count = _count_lines(chunk)
+    except Exception as e:
+        _record_error(filepath, e)
+        return None
+    with _phase('conditions'):
+        hits = query.find_hits(head + chunk, query.all_patterns, 1 if head else 0)
+    locations = {}
+    if not any(p in hits for p in query.not_patterns):
+        with _phase('locations'):
+            locations = find_match_locations(chunk, query, _worker_max_count)
+    return hits, locations, line_count
+
+def _split_ranges(filepath, range_bytes=SPLIT_RANGE_BYTES):
+    """Returns (start, end) byte ranges of about range_bytes covering a file, each ending after a \n."""
+    try:
+        with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            size = len(buf)
+            ranges = []
+            start = 0
+            while start < size:
+                end = buf.find(b'\n', start + range_bytes - 1) + 1 or size
+                ranges.append((start, end))
+                start = end
+            return ranges
+    except (OSError, ValueError):
+        return []
+
+def _merge_ranges(query, parts, max_count=None):
+    """Combines the results of _search_range for all ranges of a file into its locations."""
+    if None in parts:
         return {}
+    hits = set().union(*(part[0] for part in parts))
+    if any(p in hits for p in query.not_patterns) or not query.is_satisfied(hits):
+        return {}
+    locations = {}
+    line_offset = 0
+    for _, part_locations, line_count in parts:
+        for line, text in part_locations.items():
+            if len(locations) == max_count:
+                return locations
+            locations[line + line_offset] = text
+        line_offset += line_count
+    return locations
+
+def _can_split(filepath, query, max_count=None):
+    """Returns True if a file is large enough and of a kind to be searched in ranges.
 
-def search_files(directory, include_list, exclude_list, **kwargs):
-    """Walks through a directory and searches files based on boolean conditions."""
-    matching_files = {}
-    print(f"Searching in '{directory}'...")
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if include_list and not any(fnmatch.fnmatch(file, pattern) for pattern in include_list):
+    Without NOT patterns a max_count search of one file stops at the first
+    max_count matches, which ranges searched side by side cannot do.
+    """
+    if not isinstance(query, SearchQuery) or (max_count is not None and not query.not_patterns):
+        return False
+    return (query.stream_overlap is not None and query.positive_patterns
+            and not filepath.endswith('.xlsx') and not _is_archive(filepath)
+            and _file_size(filepath) >= SPLIT_FILE_BYTES)
+
+def _file_size(filepath):
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
+
+def _make_batches(filepaths, batch_bytes=BATCH_BYTES, batch_files=BATCH_FILES):
+    """Groups files largest-first into batches of roughly batch_bytes each.
+
+    Large files end up alone in the first batches so they start immediately,
+    while the long tail of small files is grouped to keep IPC overhead low.
+    """
+    sized = sorted(((_file_size(path), path) for path in filepaths), reverse=True)
+    batches = []
+    batch, total = [], 0
+    for size, path in sized:
+        if batch and (total + size > batch_bytes or len(batch) >= batch_files):
+            batches.append(batch)
+            batch, total = [], 0
+        batch.append(path)
+        total += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _effective_jobs(jobs):
+    """Returns the number of worker processes to use; jobs <= 0 means one per CPU."""
+    return jobs if jobs > 0 else os.cpu_count() or 1
+
+def _file_digest(filepath):
+    """Returns a hash of a file's content, or None if it cannot be read."""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.digest()
+
+def _search_kind(filepath):
+    """Returns how _search_file reads a file: 'xlsx', 'zip', a COMPRESSED_OPENERS extension or 'text'."""
+    if filepath.endswith('.xlsx'):
+        return 'xlsx'
+    if filepath.endswith('.zip'):
+        return 'zip'
+    extension = os.path.splitext(filepath)[1]
+    return extension if extension in COMPRESSED_OPENERS else 'text'
+
+def _content_key(filepath):
+    """Returns what files must share to possibly have the same search result: search kind and size."""
+    return _search_kind(filepath), _file_size(filepath)
+
+class _ContentDeduplicator:
+    """Reuses search results between files with identical content, for --dedup.
+
+    Files are told apart by search kind and size first; a file is only hashed
+    once another file of the same kind and size turns up.
+    """
+
+    def __init__(self):
+        self._first = {}
+        self._results = {}
+
+    def search(self, filepath, search):
+        """Returns search(filepath), or the result of an earlier file with the same content."""
+        key = _content_key(filepath)
+        if key not in self._first:
+            result = search(filepath)
+            self._first[key] = (filepath, result)
+            return result
+        first = self._first[key]
+        if first is not None:
+            # The first file of this size was searched without hashing it.
+            digest = _file_digest(first[0])
+            if digest is not None:
+                self._results[key + (digest,)] = first[1]
+            self._first[key] = None
+        digest = _file_digest(filepath)
+        if digest is None:
+            return search(filepath)
+        if key + (digest,) in self._results:
+            _skip('duplicate')
+        else:
+            self._results[key + (digest,)] = search(filepath)
+        return self._results[key + (digest,)]
+
+def _group_copies(filepaths, executor):
+    """Splits filepaths into one file per distinct content and a map from it to its copies.
+
+    Only files sharing their search kind and size with another file are hashed,
+    using the worker pool.
+    """
+    keyed = [(filepath, _content_key(filepath)) for filepath in filepaths]
+    groups = {}
+    for filepath, key in keyed:
+        groups.setdefault(key, set()).add(filepath)
+    to_hash = [filepath for group in groups.values() if len(group) > 1 for filepath in group]
+    digests = dict(zip(to_hash, executor.map(_file_digest, to_hash, chunksize=64)))
+    unique, copies, seen = [], {}, {}
+    for filepath, key in keyed:
+        digest = digests.get(filepath)
+        original = seen.setdefault(key + (digest,), filepath) if digest is not None else filepath
+        if original == filepath:
+            unique.append(filepath)
+        else:
+            copies.setdefault(original, []).append(filepath)
+    return unique, copies
+
+def _iter_search_serial(filepaths, query, cache, max_count, dedup, result_cache, policy):
+    search = partial(_search_file, query=query, cache=cache, max_count=max_count, result_cache=result_cache,
+                     policy=policy)
+    if _stats is not None:
+        search = partial(_stats.search, search=search)
+    if dedup:
+        search = partial(_ContentDeduplicator().search, search=search)
+    for filepath in filepaths:
+        if policy is not None and not policy.allows(filepath):
+            continue
+        locations = search(filepath)
+        if locations:
+            yield filepath, locations
+
+def _iter_search_parallel(filepaths, jobs, query, cache, max_count, dedup, result_cache, policy, executor=None):
+    """Searches files in a process pool, yielding matches as batches complete.
+
+    If the caller stops early, tasks that have not started are cancelled and
+    the workers stop after the file or range they are on. They are not
+    terminated: one killed while sending its result would leave the pool's
+    result pipe half written, and the shutdown would hang.
+    With dedup, copies of a file are reported with its result instead of
+    being searched. Large text files are split into line-aligned ranges that
+    are searched concurrently and merged once all of them are done.
+
+    executor is an optional pool set up with _init_worker that outlives the
+    search: the settings then travel with every task, and stopping early
+    only cancels the tasks that have not started.
+    """
+    if dedup and policy is not None:
+        # Applied up front so that files the policy skips are not hashed either. The workers
+        # still get the policy for archive members, and checking a file again is cheap once hashed.
+        filepaths = [filepath for filepath in filepaths if policy.allows(filepath)]
+    shared = executor is not None
+    if shared:
+        settings = pickle.dumps((query, cache, max_count, result_cache, policy, _stats is not None))
+        submit = partial(executor.submit, _run_task, settings)
+    else:
+        stop = multiprocessing.Event()
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(query, cache, max_count, result_cache, policy, stop,
+                                                 _stats is not None))
+        submit = executor.submit
+    futures = {}
+    try:
+        copies = {}
+        if dedup:
+            filepaths, copies = _group_copies(list(filepaths), executor)
+            if copies:
+                _skip('duplicate', sum(map(len, copies.values())))
+        filepaths = list(filepaths)
+        ranges = {}
+        whole = []
+        stats = {}
+        for filepath in filepaths:
+            parts = []
+            if _can_split(filepath, query, max_count):
+                if policy is not None and not policy.allows(filepath):
+                    continue
+                try:
+                    # Files with a cached result are left to _search_file.
+                    if result_cache is not None:
+                        stats[filepath] = os.stat(filepath)
+                        if result_cache.get(filepath, stats[filepath]) is None:
+                            parts = _split_ranges(filepath)
+                    else:
+                        parts = _split_ranges(filepath)
+                except (OSError, sqlite3.Error):
+                    pass
+            if len(parts) < 2:
+                whole.append(filepath)
                 continue
-            if exclude_list and any(fnmatch.fnmatch(file, pattern) for pattern in exclude_list):
+            ranges[filepath] = [submit(_search_range, filepath, start, end) for start, end in parts]
+            futures.update(dict.fromkeys(ranges[filepath], filepath))
+        futures.update(dict.fromkeys((submit(_search_batch, batch) for batch in _make_batches(whole))))
+        remaining = {filepath: len(parts) for filepath, parts in ranges.items()}
+        range_seconds = dict.fromkeys(ranges, 0.0)
+        for future in as_completed(futures):
+            filepath = futures[future]
+            results, worker_stats = future.result()
+            if worker_stats is not None:
+                _stats.merge(worker_stats)
+            if filepath is not None:
+                if worker_stats is not None:
+                    range_seconds[filepath] += sum(worker_stats.phases.values())
+                remaining[filepath] -= 1
+                if remaining[filepath]:
+                    continue
+                locations = _merge_ranges(query, [part.result()[0] for part in ranges.pop(filepath)], max_count)
+                if _stats is not None:
+                    _stats.record_file(filepath, range_seconds[filepath], locations)
+                if result_cache is not None:
+                    try:
+                        result_cache.put(filepath, stats[filepath], locations)
+                    except sqlite3.Error:
+                        pass
+                results = [(filepath, locations)] if locations else []
+            for filepath, locations in results:
+                yield filepath, locations
+                for copy in copies.get(filepath, ()):
+                    yield copy, locations
+    finally:
+        # Tasks that have not started are dropped (shutdown's cancel_futures needs Python 3.9).
+        for future in futures:
+            future.cancel()
+        if not shared:
+            stop.set()
+            executor.shutdown(wait=True)
+
+def iter_search_files(directory, include_list, exclude_list, query, jobs=1, cache=None, index=None,
+                      exclude_dirs=(), ignore_files=(), filepaths=None, max_count=None, max_files=None,
+                      dedup=False, result_cache=None, policy=None, executor=None):
+    """Yields (filepath, locations) for each matching file as soon as it has been searched.
+
+    Takes the same arguments as search_files. Files are yielded in walk order,
+    or in order of completion when searching in parallel. Each matching member
+    of a zip archive is yielded on its own as archive!member.
+    """
+    if filepaths is None:
+        filepaths = _collect_files(directory, include_list, exclude_list, exclude_dirs, ignore_files)
+    filepaths = _timed(filepaths, 'walk')
+    if index is not None:
+        filepaths = _timed(index.candidates(filepaths, query), 'index')
+    jobs = _effective_jobs(jobs)
+    if jobs > 1:
+        results = _iter_search_parallel(filepaths, jobs, query, cache, max_count, dedup, result_cache, policy,
+                                        executor)
+    else:
+        results = _iter_search_serial(filepaths, query, cache, max_count, dedup, result_cache, policy)
+    count = 0
+    try:
+        for filepath, locations in results:
+            if filepath.endswith('.zip'):
+                entries = _archive_members(filepath, locations, isinstance(query, QueryBatch))
+            else:
+                entries = [(filepath, locations)]
+            for entry in entries:
+                yield entry
+                count += 1
+                if count == max_files:
+                    return
+    finally:
+        results.close()
+
+def search_files(directory, include_list, exclude_list, query, jobs=1, cache=None, index=None,
+                 exclude_dirs=(), ignore_files=(), filepaths=None, max_count=None, max_files=None,
+                 dedup=False, result_cache=None, policy=None, executor=None):
+    """Walks through a directory and searches files based on boolean conditions.
+
+    With jobs > 1 the files are searched in a pool of worker processes and the
+    results are returned in path order; jobs <= 0 uses every available CPU.
+    cache is an optional WorkbookCache for the text of xlsx files, and index an
+    optional TrigramIndex used to skip files that cannot match. exclude_dirs and
+    ignore_files prune the walk (see _collect_files); an iterable of filepaths
+    is searched instead of walking directory at all. max_count limits the
+    locations reported per file and max_files the number of files, stopping
+    the search once it is reached. With dedup, files with identical content
+    are searched only once but all of them are reported. result_cache is an
+    optional ResultCache built for the same query and max_count, and policy an
+    optional FilePolicy that skips binary, oversized or unwanted files.
+    executor is an optional ProcessPoolExecutor set up with _init_worker to
+    search in when jobs > 1, for callers that keep one between searches.
+    """
+    if filepaths is None:
+        print(f"Searching in '{directory}'...")
+    else:
+        print("Searching listed files...")
+    results = iter_search_files(directory, include_list, exclude_list, query, jobs, cache, index,
+                                exclude_dirs, ignore_files, filepaths, max_count, max_files, dedup, result_cache,
+                                policy, executor)
+    if _effective_jobs(jobs) > 1:
+        results = sorted(results, key=lambda item: item[0])
+    return dict(results)
+
+class _Inotify:
+    """Tells --watch and the search server when anything changes under a directory, through Linux inotify.
+
+    Only used to know when to scan again: which files changed is still found
+    by walking and comparing sizes and modification times, so missed or
+    coalesced events do no harm. Unavailable (open() returns None) on other
+    systems.
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    # IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF, plus IN_ONLYDIR.
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800 | 0x01000000
+    IN_IGNORED = 0x8000
+    # inotify_init1() takes the open() flags; getattr keeps the module importable where os lacks them.
+    IN_NONBLOCK_CLOEXEC = getattr(os, 'O_NONBLOCK', 0) | getattr(os, 'O_CLOEXEC', 0)
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self._fd = fd
+        self._watches = {}
+
+    @classmethod
+    def open(cls):
+        """Returns an _Inotify, or None where inotify is not available."""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(cls.IN_NONBLOCK_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def watch_tree(self, directory, exclude_dir_re=None):
+        """Watches directory and the directories below it; returns False once the kernel's limit is reached."""
+        watched = set(self._watches.values())
+        for dirpath, dirnames, _ in os.walk(directory):
+            if exclude_dir_re is not None:
+                dirnames[:] = [d for d in dirnames if not exclude_dir_re.match(os.path.normcase(d))]
+            if dirpath in watched:
                 continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), self.MASK)
+            if wd >= 0:
+                self._watches[wd] = dirpath
+            elif ctypes.get_errno() == errno.ENOSPC:
+                return False
+        return True
 
-            filepath = os.path.join(root, file)
-            
-            if filepath.endswith('.xlsx'):
-                locations = search_in_excel(filepath, **kwargs)
+    def _drain(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                if mask & self.IN_IGNORED:
+                    # The directory is gone; watch_tree adds it again if it comes back.
+                    self._watches.pop(wd, None)
+                offset += self.EVENT.size + length
+
+    def wait(self, settle=WATCH_SETTLE):
+        """Blocks until something changes, then until nothing has changed for settle seconds."""
+        select.select([self._fd], [], [])
+        while True:
+            self._drain()
+            if not select.select([self._fd], [], [], settle)[0]:
+                return
+
+    def changed(self):
+        """Returns whether anything changed since the last call, without blocking."""
+        if not select.select([self._fd], [], [], 0)[0]:
+            return False
+        self._drain()
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+def _file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def watch_files(directory, include_list, exclude_list, query, interval=WATCH_INTERVAL, exclude_dirs=(),
+                ignore_files=(), **options):
+    """Yields (filepath, locations) for matching files under directory, then keeps watching it.
+
+    The first scan searches every file. After that the directory is scanned
+    again whenever inotify reports a change (or every interval seconds where
+    inotify is unavailable), and only files that are new or whose size or
+    modification time changed are searched. A file is yielded again only if
+    its locations changed. options are passed on to iter_search_files.
+    Runs until the caller stops iterating.
+    """
+    snapshot = {}
+    reported = {}
+    watcher = _Inotify.open()
+    try:
+        while True:
+            if watcher is not None and not watcher.watch_tree(directory, _compile_globs(exclude_dirs)):
+                watcher.close()
+                watcher = None
+            current = {}
+            for filepath in _collect_files(directory, include_list, exclude_list, exclude_dirs, ignore_files):
+                signature = _file_signature(filepath)
+                if signature is not None:
+                    current[filepath] = signature
+            changed = [filepath for filepath, signature in current.items() if snapshot.get(filepath) != signature]
+            for filepath in snapshot.keys() - current.keys():
+                reported.pop(filepath, None)
+            snapshot = current
+            if changed:
+                # A changed file that no longer matches must be yielded again if it matches later.
+                previous = {filepath: reported.pop(filepath) for filepath in changed if filepath in reported}
+                for filepath, locations in iter_search_files(directory, include_list, exclude_list, query,
+                                                             filepaths=changed, **options):
+                    reported[filepath] = locations
+                    if previous.get(filepath) != locations:
+                        yield filepath, locations
+            if watcher is not None:
+                watcher.wait()
             else:
-                locations = search_in_text(filepath, **kwargs)
-            
-            if locations:
-                matching_files[filepath] = locations
-    
-    return matching_files
+                time.sleep(interval)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+class _MemoryWorkbookCache:
+    """In-memory counterpart of WorkbookCache for the search server.
+
+    Entries are only used while the file's size and mtime are unchanged; the
+    least recently used workbooks are dropped once their text exceeds
+    max_bytes characters. Sent to a worker process, it becomes that
+    process's own cache (see _process_workbook_cache), which stays warm for
+    as long as the worker lives.
+    """
+
+    def __init__(self, max_bytes=SERVE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return _process_workbook_cache, (self.max_bytes,)
+
+    def get(self, filepath, stat):
+        """Returns the cached [sheet title, coordinate, text] cells of filepath, or None."""
+        key = os.path.abspath(filepath)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+        size, mtime_ns, cells, _ = entry
+        return cells if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns) else None
+
+    def put(self, filepath, stat, cells):
+        """Stores the cells of filepath as of stat, evicting old entries if needed."""
+        key = os.path.abspath(filepath)
+        nbytes = sum(len(text) for _, _, text in cells)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[3]
+            self._entries[key] = (stat.st_size, stat.st_mtime_ns, cells, nbytes)
+            self._total += nbytes
+            while self._total > self.max_bytes:
+                self._total -= self._entries.pop(next(iter(self._entries)))[3]
+
+_process_workbook_caches = {}
+
+def _process_workbook_cache(max_bytes):
+    """Returns this process's _MemoryWorkbookCache of max_bytes, creating it on first use."""
+    cache = _process_workbook_caches.get(max_bytes)
+    if cache is None:
+        cache = _process_workbook_caches[max_bytes] = _MemoryWorkbookCache(max_bytes)
+    return cache
+
+@lru_cache(maxsize=SERVE_QUERY_CACHE)
+def _request_query(spec):
+    """Builds the SearchQuery or QueryBatch for the JSON query part of a server request.
+
+    Cached, so a query the server has already seen is not compiled again.
+    Raises ValueError with a message for the client.
+    """
+    spec = json.loads(spec)
+    options = (bool(spec["regex"]), bool(spec["ignore_case"]), bool(spec["bytes"]))
+    try:
+        if spec["queries"] is not None:
+            return _parse_queries(spec["queries"], *options)
+        return _parse_query({key: spec[key] for key in ("and", "or", "not")}, *options)
+    except re.error as e:
+        raise ValueError(f"Invalid regular expression: {e}") from None
+
+class SearchServer:
+    """Searches one directory for requests from search_on_server, keeping its state warm in between.
+
+    The file list is walked again only when inotify reports a change (or at
+    most every rescan_interval seconds where inotify is unavailable), the text
+    of Excel files stays in cache, and compiled queries are reused. A request
+    can only narrow the served directory and its include/exclude filters.
+    Requests may be searched concurrently from several threads; with jobs > 1
+    they share executor, a ProcessPoolExecutor set up with _init_worker.
+    """
+
+    QUERY_KEYS = ("and", "or", "not", "queries", "regex", "ignore_case", "bytes")
+
+    def __init__(self, directory, include_list=(), exclude_list=(), exclude_dirs=(), ignore_files=(),
+                 cache=None, jobs=1, rescan_interval=WATCH_INTERVAL, executor=None):
+        self.directory = os.path.abspath(directory)
+        self.include_list = include_list
+        self.exclude_list = exclude_list
+        self.exclude_dirs = exclude_dirs
+        self.ignore_files = ignore_files
+        self.cache = cache
+        self.jobs = jobs
+        self.rescan_interval = rescan_interval
+        self.executor = executor
+        self._files = None
+        self._scanned = 0
+        self._watcher = _Inotify.open()
+        self._lock = threading.Lock()
+
+    def files(self):
+        """Returns the files of the served directory, walking it again only if it may have changed."""
+        with self._lock:
+            if self._files is not None:
+                if self._watcher is not None:
+                    if not self._watcher.changed():
+                        return self._files
+                elif time.monotonic() - self._scanned < self.rescan_interval:
+                    return self._files
+            if self._watcher is not None and not self._watcher.watch_tree(self.directory,
+                                                                          _compile_globs(self.exclude_dirs)):
+                self._watcher.close()
+                self._watcher = None
+            self._scanned = time.monotonic()
+            self._files = list(_collect_files(self.directory, self.include_list, self.exclude_list,
+                                              self.exclude_dirs, self.ignore_files))
+            return self._files
+
+    def _select(self, directory, include_list, exclude_list, exclude_dirs):
+        include_re = _compile_globs(include_list)
+        exclude_re = _compile_globs(exclude_list)
+        exclude_dir_re = _compile_globs(exclude_dirs)
+        for filepath in self.files():
+            relpath = os.path.relpath(filepath, directory)
+            if relpath.startswith(os.pardir + os.sep):
+                continue
+            *dirnames, name = relpath.split(os.sep)
+            if exclude_dir_re is not None and any(exclude_dir_re.match(os.path.normcase(d)) for d in dirnames):
+                continue
+            if _passes_filters(name, include_re, exclude_re):
+                yield filepath
+
+    def search(self, request):
+        """Returns an iterator of (filepath, locations) for one request, like iter_search_files.
+
+        Raises ValueError with a message for the client if the request is invalid.
+        """
+        query = _request_query(json.dumps({key: request.get(key) for key in self.QUERY_KEYS}, sort_keys=True))
+        for key in ("max_count", "max_files"):
+            value = request.get(key)
+            if value is not None and (type(value) is not int or value < 1):
+                raise ValueError(f"{key} must be an integer of at least 1")
+        for key in ("include", "exclude", "exclude_dir"):
+            value = request.get(key) or []
+            if not (isinstance(value, list) and all(isinstance(pattern, str) for pattern in value)):
+                raise ValueError(f"{key} must be a list of strings")
+        for key in ("directory", "max_filesize", "type_policy"):
+            if not isinstance(request.get(key) or "", str):
+                raise ValueError(f"{key} must be a string")
+        if request.get("binary_files", "skip") not in ("skip", "text"):
+            raise ValueError("binary_files must be 'skip' or 'text'")
+        try:
+            policy = FilePolicy(_parse_size(request["max_filesize"]) if request.get("max_filesize") else None,
+                                request.get("binary_files", "skip") == "skip",
+                                FilePolicy.parse_rules(request["type_policy"]) if request.get("type_policy") else ())
+        except ValueError as e:
+            raise ValueError(f"Invalid file policy: {e}") from None
+        directory = os.path.abspath(request.get("directory") or self.directory)
+        if directory != self.directory and not directory.startswith(os.path.join(self.directory, '')):
+            raise ValueError(f"'{directory}' is not inside the served directory '{self.directory}'")
+        filepaths = self._select(directory, request.get("include") or [], request.get("exclude") or [],
+                                 request.get("exclude_dir") or [])
+        return iter_search_files(self.directory, [], [], query, jobs=self.jobs, cache=self.cache,
+                                 filepaths=filepaths, max_count=request.get("max_count"),
+                                 max_files=request.get("max_files"), dedup=bool(request.get("dedup")),
+                                 policy=policy, executor=self.executor)
+
+class _SearchRequestHandler(socketserver.StreamRequestHandler):
+    """Answers one request line with {"ok": true}, a line per matching file and {"done": true}, or {"error": ...}."""
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def _fail(self, error):
+        """Logs an unexpected error and reports it to the client, instead of just dropping the connection."""
+        print(f"Error: A search request failed: {error!r}", file=sys.stderr)
+        traceback.print_exc()
+        with contextlib.suppress(OSError):
+            self._send({"error": f"The search failed on the server: {error}"})
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Another 'serve' checking whether the socket is in use.
+            return
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a JSON object")
+            results = self.server.search_server.search(request)
+        except ValueError as e:
+            with contextlib.suppress(OSError):
+                self._send({"error": str(e)})
+            return
+        except Exception as e:
+            self._fail(e)
+            return
+        batch = request.get("queries") is not None
+        try:
+            self._send({"ok": True})
+            for filepath, locations in results:
+                if batch:
+                    self._send({"path": filepath, "queries": {name: list(query_locations.items())
+                                                              for name, query_locations in locations.items()}})
+                else:
+                    self._send({"path": filepath, "matches": list(locations.items())})
+                self.wfile.flush()
+            self._send({"done": True})
+        except OSError:
+            # The client went away (e.g. `| head`); stop searching.
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            results.close()
+
+def search_on_server(address, directory, request):
+    """Sends a search request to the server listening on the Unix socket address.
+
+    request holds the query ("and", "or", "not" or "queries", "regex",
+    "ignore_case", "bytes") and optional "include", "exclude", "exclude_dir",
+    "max_count", "max_files", "dedup", "max_filesize", "binary_files" and
+    "type_policy" values. directory must be inside the served directory.
+    Returns an iterator of (filepath, locations) like iter_search_files,
+    with paths under directory as given. Raises OSError if the server cannot
+    be reached, ValueError if it rejects the request, and ConnectionError if
+    the search fails or the connection breaks before it is done.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        sock.sendall(json.dumps(dict(request, directory=os.path.abspath(directory))).encode('utf-8') + b'\n')
+        replies = sock.makefile('rb')
+        reply = json.loads(replies.readline() or b'{"error": "The server closed the connection."}')
+    except BaseException:
+        sock.close()
+        raise
+    if "error" in reply:
+        sock.close()
+        raise ValueError(reply["error"])
+    return _iter_replies(sock, replies, directory)
+
+def _iter_replies(sock, replies, directory):
+    base = os.path.abspath(directory)
+    try:
+        for line in replies:
+            reply = json.loads(line)
+            if reply.get("done"):
+                return
+            if "error" in reply:
+                raise ConnectionError(reply["error"])
+            filepath = os.path.join(directory, os.path.relpath(reply["path"], base))
+            if "queries" in reply:
+                yield filepath, {name: dict(pairs) for name, pairs in reply["queries"].items()}
+            else:
+                yield filepath, dict(reply["matches"])
+        raise ConnectionError("The server closed the connection before the search finished.")
+    finally:
+        replies.close()
+        sock.close()
+
+def _write_stats(wall_seconds, summary, json_path):
+    """Prints the --stats summary and writes the --stats-json profile of the run."""
+    if summary:
+        _stats.report(wall_seconds)
+    if json_path:
+        try:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(_stats.to_dict(wall_seconds), f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"Error: Cannot write stats profile: {e}", file=sys.stderr)
+
+def _add_filter_arguments(parser):
+    """Adds the options shared by a search, 'index' and 'serve': which files to read, and --cache-dir."""
+    parser.add_argument("--include", help="Comma-separated list of file patterns to include (e.g., '*.py,*.txt').")
+    parser.add_argument("--exclude", help="Comma-separated list of file patterns to exclude (e.g., '*.log,*.tmp').")
+    parser.add_argument("--exclude-dir", help="Comma-separated list of directory name patterns to skip entirely (e.g., '.git,node_modules').")
+    parser.add_argument("--ignore-file", help="Comma-separated list of .gitignore-style file names to honour in every directory (e.g., '.gitignore').")
+    parser.add_argument("--cache-dir", metavar="DIR", help="Cache the text extracted from Excel files in DIR and reuse it while a file is unchanged.")
+
+def _split_list(value):
+    """Returns the items of a comma-separated option, or an empty list if it was not given."""
+    return value.split(',') if value else []
+
+def _index_command(argv):
+    """Runs the 'index' subcommand: builds or updates a trigram index."""
+    parser = argparse.ArgumentParser(
+        prog="search.py index",
+        description="Build or incrementally update a trigram index for use with --index."
+    )
+    parser.add_argument("directory", help="The directory to index.")
+    parser.add_argument("--index", required=True, metavar="FILE", help="The index file to create or update.")
+    _add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"Error: Directory not found at '{args.directory}'")
+        exit(1)
+
+    include_list = _split_list(args.include)
+    exclude_list = _split_list(args.exclude)
+    exclude_dirs = _split_list(args.exclude_dir)
+    ignore_files = _split_list(args.ignore_file)
+    cache = WorkbookCache(args.cache_dir) if args.cache_dir else None
+
+    print(f"Indexing '{args.directory}'...")
+    indexed, removed = TrigramIndex(args.index).update(args.directory, include_list, exclude_list, cache,
+                                                       exclude_dirs, ignore_files)
+    print(f"Indexed {indexed} file(s), removed {removed} file(s).")
+
+def _serve_command(argv):
+    """Runs the 'serve' subcommand: answers --server searches of one directory until interrupted."""
+    parser = argparse.ArgumentParser(
+        prog="search.py serve",
+        description="Keep a directory's file list, Excel text and compiled queries in memory and answer searches "
+                    "from 'search.py DIRECTORY --server SOCKET ...' over a Unix socket."
+    )
+    parser.add_argument("directory", help="The directory to serve; clients can search it or any directory below it.")
+    parser.add_argument("--socket", required=True, metavar="PATH", help="The Unix socket to listen on (only the current user can connect).")
+    _add_filter_arguments(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Number of worker processes per search (default: 1, 0 = all CPUs).")
+    parser.add_argument("--cache-size", type=int, metavar="MB", help=f"Maximum size of the Excel cache (default: {SERVE_CACHE_BYTES // (1024 * 1024)} in memory, per worker process with --jobs; {DEFAULT_CACHE_BYTES // (1024 * 1024)} with --cache-dir).")
+    parser.add_argument("--rescan-interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS", help="Where inotify is not available, how old the file list may get before a search walks the directory again (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+        print("Error: 'serve' needs Unix domain sockets, which this platform does not provide.")
+        exit(1)
+    if not os.path.isdir(args.directory):
+        print(f"Error: Directory not found at '{args.directory}'")
+        exit(1)
+    if os.path.lexists(args.socket):
+        if not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+            print(f"Error: '{args.socket}' already exists and is not a socket")
+            exit(1)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(args.socket)
+        except OSError:
+            os.remove(args.socket)  # Left behind by a server that did not shut down cleanly.
+        else:
+            print(f"Error: A server is already listening on '{args.socket}'")
+            exit(1)
+
+    include_list = _split_list(args.include)
+    exclude_list = _split_list(args.exclude)
+    exclude_dirs = _split_list(args.exclude_dir)
+    ignore_files = _split_list(args.ignore_file)
+    if args.cache_dir:
+        cache = WorkbookCache(args.cache_dir, (args.cache_size or DEFAULT_CACHE_BYTES // (1024 * 1024)) * 1024 * 1024)
+    else:
+        # With --jobs every worker keeps a cache of its own (see _MemoryWorkbookCache).
+        cache = _MemoryWorkbookCache((args.cache_size or SERVE_CACHE_BYTES // (1024 * 1024)) * 1024 * 1024)
+    jobs = _effective_jobs(args.jobs)
+    executor = None
+    if jobs > 1:
+        # One pool for the life of the server, so that the workers' caches stay warm between searches.
+        # Started right away, before any request thread exists to be forked with them.
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(None, None, None, None, None, multiprocessing.Event()))
+        executor.submit(int).result()
+
+    search_server = SearchServer(args.directory, include_list, exclude_list, exclude_dirs, ignore_files, cache,
+                                 jobs, args.rescan_interval, executor)
+    search_server.files()
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(args.socket, _SearchRequestHandler)
+    finally:
+        os.umask(old_umask)
+    # A client that stops reading only holds up its own thread, which must not keep the server from exiting.
+    server.daemon_threads = True
+    server.search_server = search_server
+    print(f"Serving '{args.directory}' on '{args.socket}' (Ctrl+C to stop)...")
+    # Stopped by a service manager or kill: clean up as for Ctrl+C, so the pool's workers exit too.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        if executor is not None:
+            # Searches still running in request threads are abandoned. Their queued tasks are
+            # cancelled by hand, as shutdown's cancel_futures needs Python 3.9.
+            for work_item in list(executor._pending_work_items.values()):
+                work_item.future.cancel()
+            executor.shutdown(wait=True)
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["index"]:
+        _index_command(sys.argv[2:])
+        exit(0)
+    if sys.argv[1:2] == ["serve"]:
+        _serve_command(sys.argv[2:])
+        exit(0)
+
     parser = argparse.ArgumentParser(
-        description="Search for files based on complex AND/OR/NOT conditions."
+        description="Search for files based on complex AND/OR/NOT conditions.",
+        epilog="Use 'search.py index DIRECTORY --index FILE' to build or update a trigram index, and "
+               "'search.py serve DIRECTORY --socket PATH' to start a server for --server."
     )
-    parser.add_argument("directory", help="The directory to search in.")
+    parser.add_argument("directory", nargs="?", help="The directory to search in (omit with --files-from).")
     parser.add_argument("--and", action="append", dest="and_patterns", metavar="PATTERN", help="Pattern that MUST exist (can be used multiple times).")
     parser.add_argument("--or", action="append", dest="or_patterns", metavar="PATTERN", help="Pattern where at least one MUST exist (can be used multiple times).")
     parser.add_argument("--not", action="append", dest="not_patterns", metavar="PATTERN", help="Pattern that must NOT exist (can be used multiple times).")
+    parser.add_argument("--queries", metavar="FILE", help="Run the named queries in a JSON file ({\"name\": {\"and\": [...], \"or\": [...], \"not\": [...]}, ...}) in one pass over the files, instead of --and/--or/--not.")
     parser.add_argument("-r", "--regex", action="store_true", help="Treat patterns as regular expressions.")
     parser.add_argument("-i", "--ignore-case", action="store_true", help="Perform case-insensitive search.")
-    parser.add_argument("--include", help="Comma-separated list of file patterns to include (e.g., '*.py,*.txt').")
-    parser.add_argument("--exclude", help="Comma-separated list of file patterns to exclude (e.g., '*.log,*.tmp').")
+    _add_filter_arguments(parser)
+    parser.add_argument("--files-from", metavar="FILE", help="Search the files listed one per line in FILE ('-' for stdin) instead of walking a directory.")
+    parser.add_argument("--bytes", action="store_true", dest="as_bytes", help="Search the raw UTF-8 bytes of text files via mmap instead of decoding them (case folding and \\d, \\w, ... are ASCII-only).")
+    parser.add_argument("-l", "--files-with-matches", action="store_true", help="Only print the paths of matching files, as soon as each is found.")
+    parser.add_argument("--max-count", type=int, metavar="N", help="Report at most N matching lines (or cells) per file.")
+    parser.add_argument("--max-files", type=int, metavar="N", help="Stop the search after N matching files.")
+    parser.add_argument("--max-filesize", metavar="SIZE", help="Skip files larger than SIZE (e.g. 500K, 10M, 2G).")
+    parser.add_argument("--binary-files", choices=("skip", "text"), default="skip", help="Skip files whose first block has a NUL byte or a known binary header (default), or search them as text anyway.")
+    parser.add_argument("--type-policy", metavar="RULES", help="Comma-separated GLOB=ACTION rules, first match wins: skip, text (search without the binary check), sniff, or a SIZE limit for that type (e.g. '*.pdf=skip,*.log=text,*.csv=50M').")
+    parser.add_argument("--dedup", action="store_true", help="Search files with identical content (same size, then same hash) only once; every copy is still reported.")
+    parser.add_argument("--jsonl", action="store_true", help="Write one JSON object per matching file as soon as it is found, instead of the report.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Number of worker processes (default: 1, 0 = all CPUs).")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), metavar="MB", help="Maximum size of the Excel cache before old entries are evicted (default: %(default)s).")
+    parser.add_argument("--cache-results", action="store_true", help="Also cache each file's results for this query in --cache-dir, so a rerun only searches files that changed.")
+    parser.add_argument("--stats", action="store_true", help="Print where the time went to stderr at the end: per phase, bytes searched, files skipped or failed (with the reason) and the slowest files.")
+    parser.add_argument("--stats-json", metavar="FILE", help="Write the same statistics as a JSON profile to FILE.")
+    parser.add_argument("--watch", action="store_true", help="Keep running after the search and print files again whenever their results change (new or modified files are searched as soon as they are saved).")
+    parser.add_argument("--watch-interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS", help="How often --watch rescans the directory where inotify is not available (default: %(default)s).")
+    parser.add_argument("--server", metavar="SOCKET", help="Send the search to a server started with 'search.py serve' on the Unix socket SOCKET, which keeps the file list, Excel text and compiled queries warm between searches.")
+    parser.add_argument("--index", metavar="FILE", help="Only search the files a trigram index built with 'search.py index' marks as possible matches (changed files are always searched).")
     
     args = parser.parse_args()
 
-    if not (args.and_patterns or args.or_patterns):
+    if args.queries:
+        if args.and_patterns or args.or_patterns or args.not_patterns:
+            print("Error: Give either --queries or --and/--or/--not patterns, not both.")
+            exit(1)
+    elif not (args.and_patterns or args.or_patterns):
         print("Error: You must provide at least one --and or --or pattern to search for.")
         exit(1)
 
-    try:
-        import openpyxl
-    except ImportError:
-        print("Error: The 'openpyxl' library is required to search Excel files.")
-        print("Please install it by running: pip install openpyxl")
+    for option, value in (("--max-count", args.max_count), ("--max-files", args.max_files)):
+        if value is not None and value < 1:
+            print(f"Error: {option} must be at least 1.")
+            exit(1)
+
+    if args.watch and (args.files_from is not None or args.max_files is not None):
+        print("Error: --watch cannot be combined with --files-from or --max-files.")
+        exit(1)
+    if args.watch_interval <= 0:
+        print("Error: --watch-interval must be greater than 0.")
         exit(1)
 
-    if not os.path.isdir(args.directory):
+    if args.files_from is not None:
+        if args.directory is not None:
+            print("Error: Give either a directory or --files-from, not both.")
+            exit(1)
+    elif args.directory is None:
+        print("Error: You must provide a directory to search in (or --files-from).")
+        exit(1)
+    elif not os.path.isdir(args.directory):
         print(f"Error: Directory not found at '{args.directory}'")
         exit(1)
 
-    include_list = args.include.split(',') if args.include else []
-    exclude_list = args.exclude.split(',') if args.exclude else []
+    if args.server:
+        # These are chosen when the server is started, or need local state.
+        for option, value in (("--files-from", args.files_from), ("--watch", args.watch),
+                              ("--ignore-file", args.ignore_file), ("--jobs", args.jobs != 1),
+                              ("--cache-dir", args.cache_dir), ("--index", args.index),
+                              ("--stats", args.stats), ("--stats-json", args.stats_json)):
+            if value:
+                print(f"Error: {option} cannot be used with --server.")
+                exit(1)
+
+    include_list = _split_list(args.include)
+    exclude_list = _split_list(args.exclude)
+    exclude_dirs = _split_list(args.exclude_dir)
+    ignore_files = _split_list(args.ignore_file)
+
+    try:
+        if args.queries:
+            query = load_queries(args.queries, args.regex, args.ignore_case, args.as_bytes)
+        else:
+            query = SearchQuery(
+                and_patterns=args.and_patterns,
+                or_patterns=args.or_patterns,
+                not_patterns=args.not_patterns,
+                use_regex=args.regex,
+                ignore_case=args.ignore_case,
+                as_bytes=args.as_bytes
+            )
+    except re.error as e:
+        print(f"Error: Invalid regular expression: {e}")
+        exit(1)
+    except OSError as e:
+        print(f"Error: Cannot read queries: {e}")
+        exit(1)
+    except ValueError as e:
+        print(f"Error: Invalid queries file: {e}")
+        exit(1)
 
-    search_kwargs = {
-        "and_patterns": args.and_patterns,
-        "or_patterns": args.or_patterns,
-        "not_patterns": args.not_patterns,
-        "use_regex": args.regex,
-        "ignore_case": args.ignore_case
-    }
+    if args.cache_results and not args.cache_dir:
+        print("Error: --cache-results requires --cache-dir.")
+        exit(1)
+    if args.cache_results and args.queries:
+        print("Error: --cache-results cannot be combined with --queries.")
+        exit(1)
 
-    found_files = search_files(args.directory, include_list, exclude_list, **search_kwargs)
+    try:
+        max_filesize = _parse_size(args.max_filesize) if args.max_filesize else None
+        policy = FilePolicy(max_filesize, args.binary_files == "skip",
+                            FilePolicy.parse_rules(args.type_policy) if args.type_policy else ())
+    except ValueError as e:
+        print(f"Error: Invalid file policy: {e}")
+        exit(1)
 
-    if found_files:
+    if args.index and not os.path.isfile(args.index):
+        print(f"Error: Index not found at '{args.index}'")
+        exit(1)
+
+    cache = WorkbookCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    index = TrigramIndex(args.index) if args.index else None
+
+    file_list = None
+    if args.files_from == '-':
+        file_list = _read_file_list(sys.stdin, include_list, exclude_list)
+    elif args.files_from is not None:
+        try:
+            file_list = _read_file_list(open(args.files_from, 'r', encoding='utf-8'), include_list, exclude_list)
+        except OSError as e:
+            print(f"Error: Cannot read file list: {e}")
+            exit(1)
+
+    if args.stats or args.stats_json:
+        _stats = SearchStats()
+    started = time.perf_counter()
+
+    # A single location is enough to know that a file matches.
+    max_count = 1 if args.files_with_matches else args.max_count
+    result_cache = None
+    if args.cache_results:
+        result_cache = ResultCache(args.cache_dir, query, max_count, args.cache_size * 1024 * 1024)
+
+    if args.watch:
+        print(f"Watching '{args.directory}' for changes (Ctrl+C to stop)...", file=sys.stderr)
+        results = watch_files(args.directory, include_list, exclude_list, query, interval=args.watch_interval,
+                              exclude_dirs=exclude_dirs, ignore_files=ignore_files, jobs=args.jobs, cache=cache,
+                              index=index, max_count=max_count, dedup=args.dedup, result_cache=result_cache,
+                              policy=policy)
+    elif args.server:
+        request = {"and": args.and_patterns, "or": args.or_patterns, "not": args.not_patterns, "queries": None,
+                   "regex": args.regex, "ignore_case": args.ignore_case, "bytes": args.as_bytes,
+                   "include": include_list, "exclude": exclude_list, "exclude_dir": exclude_dirs,
+                   "max_count": max_count, "max_files": args.max_files, "dedup": args.dedup,
+                   "max_filesize": args.max_filesize, "binary_files": args.binary_files,
+                   "type_policy": args.type_policy}
+        if args.queries:
+            # Already validated by load_queries above.
+            with open(args.queries, 'r', encoding='utf-8') as f:
+                request["queries"] = json.load(f)
+        try:
+            results = search_on_server(args.server, args.directory, request)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+        except OSError as e:
+            print(f"Error: Cannot connect to the server at '{args.server}': {e}")
+            exit(1)
+    elif args.jsonl or args.files_with_matches:
+        results = iter_search_files(args.directory, include_list, exclude_list, query, jobs=args.jobs, cache=cache,
+                                    index=index, exclude_dirs=exclude_dirs, ignore_files=ignore_files, filepaths=file_list,
+                                    max_count=max_count, max_files=args.max_files, dedup=args.dedup,
+                                    result_cache=result_cache, policy=policy)
+
+    if args.watch or args.jsonl or args.files_with_matches:
+        try:
+            for filepath, locations in results:
+                if args.queries:
+                    for name, query_locations in locations.items():
+                        if args.files_with_matches and args.jsonl:
+                            print(json.dumps({"query": name, "path": filepath}), flush=True)
+                        elif args.files_with_matches:
+                            print(f"{name}\t{filepath}", flush=True)
+                        elif args.jsonl:
+                            matches = [{"location": loc, "content": content} for loc, content in query_locations.items()]
+                            print(json.dumps({"query": name, "path": filepath, "matches": matches}), flush=True)
+                        else:
+                            print(f"\n[{name}] {filepath}:")
+                            for loc, content in query_locations.items():
+                                print(f"  {loc}: {content}")
+                            sys.stdout.flush()
+                elif args.files_with_matches and args.jsonl:
+                    print(json.dumps({"path": filepath}), flush=True)
+                elif args.files_with_matches:
+                    print(filepath, flush=True)
+                elif args.jsonl:
+                    matches = [{"location": loc, "content": content} for loc, content in locations.items()]
+                    print(json.dumps({"path": filepath, "matches": matches}), flush=True)
+                else:
+                    print(f"\n{filepath}:")
+                    for loc, content in locations.items():
+                        print(f"  {loc}: {content}")
+                    sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. `| head`); stop searching quietly.
+            results.close()
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        except KeyboardInterrupt:
+            # The normal way to leave --watch.
+            results.close()
+        except ConnectionError as e:
+            print(f"Error: {e}")
+            exit(1)
+        if _stats is not None:
+            _write_stats(time.perf_counter() - started, args.stats, args.stats_json)
+        exit(0)
+
+    if args.server:
+        print(f"Searching in '{args.directory}'...")
+        try:
+            # The server sends files as they are found, so in completion order with several workers.
+            found_files = dict(sorted(results, key=lambda item: item[0]))
+        except ConnectionError as e:
+            print(f"Error: {e}")
+            exit(1)
+    else:
+        found_files = search_files(args.directory, include_list, exclude_list, query, jobs=args.jobs, cache=cache,
+                                   index=index, exclude_dirs=exclude_dirs, ignore_files=ignore_files,
+                                   filepaths=file_list, max_count=max_count, max_files=args.max_files,
+                                   dedup=args.dedup, result_cache=result_cache, policy=policy)
+
+    if args.queries:
+        for name in query.queries:
+            matching = {filepath: results[name] for filepath, results in found_files.items() if name in results}
+            if matching:
+                print(f"\n--- Query '{name}': found {len(matching)} matching files: ---")
+                for filepath, locations in matching.items():
+                    print(f"\n{filepath}:")
+                    for loc, content in locations.items():
+                        print(f"  {loc}: {content}")
+            else:
+                print(f"\n--- Query '{name}': no matching files found. ---")
+        print("\n--------------------------")
+    elif found_files:
         print("\n--- Found matching files: ---")
         for filepath, locations in found_files.items():
             print(f"\n{filepath}:")
@@ -170,3 +3333,6 @@ if __name__ == "__main__":
         print("\n--------------------------")
     else:
         print("\nNo matching files found.")
+
+    if _stats is not None:
+        _write_stats(time.perf_counter() - started, args.stats, args.stats_json)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestAdaptiveOrder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(3 * search.REORDER_INTERVAL):
+            path = os.path.join(self.directory, f"f{i}.txt")
+            with open(path, 'w') as f:
+                f.write('hay\n' * 20)
+                if i % 3 == 0:
+                    f.write(f'needle_{i}\n')
+                if i % 5 == 0:
+                    f.write('forbidden\n')
+                if i % 7 == 0:
+                    f.write('other 42\n')
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def search_all(self, query):
+        return {path: search.search_in_text(path, query) for path in self.paths}
+
+    def expected(self, query):
+        """並べ替えのない、ファイル全体に対する条件判定の結果"""
+        results = {}
+        for path in self.paths:
+            with open(path) as f:
+                content = f.read()
+            hits = {p for p in query.all_patterns if query.compiled[p].search(content)}
+            if not any(p in hits for p in query.not_patterns) and query.is_satisfied(hits):
+                results[path] = search.find_match_locations(content, query)
+            else:
+                results[path] = {}
+        return results
+
+    def test_streaming_search_uses_the_order(self):
+        """正規表現のストリーミング検索で順序の統計が記録され、結果が変わらないかテスト"""
+        query = search.SearchQuery(['needle_\\d+'], None, ['forbidden'], use_regex=True)
+        self.assertEqual(self.search_all(query), self.expected(query))
+        runs = {pattern: stats[0] for pattern, stats in query.hit_order._stats.items()}
+        self.assertEqual(runs['forbidden'], len(self.paths))
+        self.assertGreater(runs['needle_\\d+'], 0)
+
+    def test_or_patterns_stop_after_first_hit(self):
+        """OR パターンは1つ見つかれば残りを探さず、結果が変わらないかテスト"""
+        query = search.SearchQuery(None, ['zzz\\d', 'hay', 'other \\d+'], ['forbidden'], use_regex=True)
+        self.assertEqual(self.search_all(query), self.expected(query))
+        stats = query.hit_order._stats
+        self.assertEqual(stats['hay'][1], stats['hay'][0])
+        self.assertLess(stats['zzz\\d'][0], len(self.paths))
+
+    def test_shared_and_or_pattern_is_still_required(self):
+        """AND と OR の両方にあるパターンは OR が満たされた後も探されるかテスト"""
+        query = search.SearchQuery(['needle_\\d+'], ['hay', 'needle_\\d+'], use_regex=True)
+        self.assertEqual(self.search_all(query), self.expected(query))
+
+
+if __name__ == '__main__':
+    unittest.main()
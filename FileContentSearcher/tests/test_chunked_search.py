@@ -0,0 +1,238 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+WORDS = ['foo', 'bar', 'xfoo', 'foobar', 'baz', 'Foo', '  ', 'qux', 'hello', 'world', '42', 'é', '日本']
+LINE_BREAKS = ['\n', '\n', '\n', '\r\n', '\r', '\x0c']
+
+# (AND, OR, NOT, 正規表現か, 大文字小文字を無視するか)
+QUERIES = [
+    (['^foo'], [], [], True, False),
+    (['bar$'], [], [], True, False),
+    (['\\bfoo\\b'], [], ['zzz'], True, False),
+    (['(?<=x)foo'], [], [], True, False),
+    (['foo\\s{1,3}bar'], [], [], True, False),
+    (['foo\\s+bar'], [], [], True, False),
+    (['hello'], ['world$', '^baz'], ['forbidden'], True, False),
+    (['filler'], [], ['foo\\s{1,4}bar'], True, False),
+    ([], ['\\d+', 'qux'], ['^forbidden$'], True, True),
+    (['foo'], [], ['forbidden'], False, False),
+    (['FOO', 'bar'], [], [], False, True),
+    ([], ['日本', 'é'], ['forbidden'], False, False),
+    ([], ['hello', 'qux'], ['qux'], False, True),
+]
+
+
+def random_text(rnd, lines):
+    parts = []
+    for _ in range(lines):
+        parts.append(' '.join(rnd.choice(WORDS) for _ in range(rnd.randrange(0, 6))))
+        parts.append(rnd.choice(LINE_BREAKS))
+    return ''.join(parts)
+
+
+class ChunkedSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rnd = random.Random(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text, name='file.txt'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        return path
+
+    def whole_buffer(self, path, query, max_count=None):
+        """ファイル全体を一度に読んで条件判定と位置抽出を行った結果"""
+        if query.as_bytes:
+            with open(path, 'rb') as f:
+                content = f.read()
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        if not search.check_file_conditions(content, query):
+            return {}
+        return search.find_match_locations(content, query, max_count)
+
+    def texts(self):
+        yield random_text(self.rnd, 200)
+        yield random_text(self.rnd, 200) + 'foo\nforbidden\n'
+        yield 'foo\r\n\r\nbar' + '\r\n' * 3 + ' foo  \x0c  bar\x0cfoo\rbar'
+        yield 'foo ' * 500 + '\nbar\n'
+        # The only matches of foo\s...bar span a line break, and so a chunk or range boundary.
+        yield 'filler\n' * 10 + 'foo\n\n bar\n' + 'filler\n' * 10
+
+    def queries(self, as_bytes=False):
+        for and_patterns, or_patterns, not_patterns, use_regex, ignore_case in QUERIES:
+            yield search.SearchQuery(and_patterns, or_patterns, not_patterns, use_regex=use_regex,
+                                     ignore_case=ignore_case, as_bytes=as_bytes)
+
+
+class TestStreaming(ChunkedSearchTestCase):
+
+    def test_tiny_chunks(self):
+        """小さなチャンクに分けて読んでもファイル全体の検索と同じ結果になるかテスト"""
+        read_chunks = search._read_chunks
+        for text in self.texts():
+            path = self.write(text)
+            for query in self.queries():
+                expected = self.whole_buffer(path, query)
+                for chunk_size in (1, 7, 64):
+                    for max_count in (None, 1, 3):
+                        read = lambda f, size=chunk_size, **options: read_chunks(f, size, **options)
+                        with self.subTest(patterns=query.all_patterns, chunk_size=chunk_size, max_count=max_count), \
+                                mock.patch.object(search, '_read_chunks', read):
+                            limited = expected if max_count is None else dict(list(expected.items())[:max_count])
+                            self.assertEqual(search.search_in_text(path, query, max_count), limited)
+
+    def test_long_lines_in_pieces(self):
+        """リテラル検索で長い行を分割して読んでも、行番号と条件判定が変わらず、読む量が制限されるかテスト"""
+        read_chunks = search._read_chunks
+        pieces = []
+
+        def small_pieces(f, size=7, **options):
+            for piece in read_chunks(f, size, **{**options, 'max_line': 50}):
+                pieces.append(piece)
+                yield piece
+
+        queries = [search.SearchQuery(['needle']), search.SearchQuery(['NEEDLE'], [], ['forbidden'], ignore_case=True),
+                   search.SearchQuery([], ['zzz', 'needle'], ['forbidden'])]
+        for offset in range(0, 130, 3):
+            for query in queries:
+                for extra in ('', 'forbidden'):
+                    long_line = 'x' * offset + 'needle' + 'y' * (130 - offset) + extra
+                    path = self.write(f'short\r\n{long_line}\n\nneedle again\n' + 'z' * 200)
+                    expected = self.whole_buffer(path, query)
+                    with self.subTest(offset=offset, patterns=query.all_patterns, extra=extra), \
+                            mock.patch.object(search, '_read_chunks', small_pieces):
+                        self.assertEqual(list(search.search_in_text(path, query)), list(expected))
+        # max_line, plus at most one read and the longest pattern.
+        self.assertLessEqual(max(map(len, pieces)), 50 + 7 + len('forbidden'))
+
+    def test_lower_changes_length(self):
+        """小文字にすると長さが変わる文字 (İ) を含むファイルでも、-i のリテラル検索で行が見つかるかテスト"""
+        read_chunks = search._read_chunks
+        path = self.write('hello\n\u0130STANBUL trip\r\nbye\n' * 3)
+        cases = [
+            (search.SearchQuery(['i\u0307stanbul'], ignore_case=True), {2: 'İSTANBUL trip', 5: 'İSTANBUL trip'}),
+            (search.SearchQuery([], ['BYE', 'i\u0307'], ignore_case=True),
+             {2: 'İSTANBUL trip', 3: 'bye', 5: 'İSTANBUL trip'}),
+        ]
+        for query, expected in cases:
+            for chunk_size in (7, search.CHUNK_SIZE):
+                read = lambda f, size=chunk_size, **options: read_chunks(f, size, **options)
+                with self.subTest(patterns=query.all_patterns, chunk_size=chunk_size), \
+                        mock.patch.object(search, '_read_chunks', read):
+                    self.assertEqual(search.search_in_text(path, query, max_count=len(expected)), expected)
+            self.assertEqual(self.whole_buffer(path, query, len(expected)), expected)
+
+    def test_dense_literal_lines(self):
+        """必須リテラルのある行が密な場合に全体の正規表現検索へ切り替えても結果が変わらないかテスト"""
+        path = self.write('xfoo foo\n' * 50 + 'baz\n' * 50 + 'foo bar\n' * 5)
+        for query in self.queries():
+            expected = self.whole_buffer(path, query)
+            for window in (1, 2, 64):
+                with self.subTest(patterns=query.all_patterns, window=window), \
+                        mock.patch.object(search, 'LITERAL_WINDOW_LINES', window):
+                    self.assertEqual(search.search_in_text(path, query), expected)
+
+
+class TestRanges(ChunkedSearchTestCase):
+
+    def search_ranges(self, path, query, range_bytes, max_count=None):
+        search._init_worker(query, None, max_count, None, None, threading.Event())
+        parts = [search._scan_range(path, start, end) for start, end in search._split_ranges(path, range_bytes)]
+        return search._merge_ranges(query, parts, max_count)
+
+    def test_split_ranges_cover_file(self):
+        """分割した範囲が行の途中で切れずにファイル全体を覆うかテスト"""
+        path = self.write(random_text(self.rnd, 300))
+        with open(path, 'rb') as f:
+            data = f.read()
+        for range_bytes in (1, 10, 100, len(data) + 1):
+            ranges = search._split_ranges(path, range_bytes)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_tiny_ranges(self):
+        """小さな範囲に分けて検索してもファイル全体の検索と同じ結果になるかテスト"""
+        for text in self.texts():
+            path = self.write(text)
+            for as_bytes in (False, True):
+                for query in self.queries(as_bytes):
+                    if query.stream_overlap is None:
+                        continue
+                    for max_count in (None, 2):
+                        expected = self.whole_buffer(path, query, max_count)
+                        for range_bytes in (1, 16, 200):
+                            with self.subTest(patterns=query.all_patterns, as_bytes=as_bytes,
+                                              range_bytes=range_bytes, max_count=max_count):
+                                self.assertEqual(self.search_ranges(path, query, range_bytes, max_count), expected)
+
+    def test_not_hit_in_later_range(self):
+        """後ろの範囲にしかない NOT パターンでファイル全体が除外されるかテスト"""
+        path = self.write('foo bar\n' * 200 + 'forbidden\n' + 'foo\n' * 10)
+        query = search.SearchQuery(['foo'], [], ['forbidden'], use_regex=True)
+        self.assertEqual(self.search_ranges(path, query, 64), {})
+        query = search.SearchQuery(['foo'], [], ['forbid\\w+'], use_regex=True)
+        self.assertEqual(self.search_ranges(path, query, 64, max_count=1), {})
+
+    def test_line_numbers_continue_across_ranges(self):
+        """範囲をまたいでも行番号が通しで数えられるかテスト"""
+        path = self.write(''.join(f'line {i}\r\n' if i % 2 else f'line {i}\x0c\n' for i in range(1, 101)))
+        query = search.SearchQuery(['line 9\\d\\b'], use_regex=True)
+        expected = self.whole_buffer(path, query)
+        self.assertTrue(expected)
+        self.assertEqual(self.search_ranges(path, query, 32), expected)
+
+    def test_parallel_search_with_max_count(self):
+        """分割の閾値を超えるファイルを max_count 付きの並列検索とクエリ一括検索で扱えるかテスト"""
+        self.write('foo bar\n' * 2000 + 'hello world\n' * 10)
+        self.write('baz\n' * 10, 'small.txt')
+        queries = [
+            search.SearchQuery(['foo'], [], ['forbidden'], use_regex=True),
+            search.QueryBatch({'a': search.SearchQuery(['foo']),
+                               'b': search.SearchQuery(['hello'], [], ['forbidden'], use_regex=True)}),
+        ]
+        for query in queries:
+            for max_count in (None, 1, 3):
+                with self.subTest(query=type(query).__name__, max_count=max_count), \
+                        mock.patch.object(search, 'SPLIT_FILE_BYTES', 1024), \
+                        mock.patch.object(search._split_ranges, '__defaults__', (2048,)), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    expected = search.search_files(self.directory, [], [], query, max_count=max_count)
+                    self.assertTrue(expected)
+                    self.assertEqual(search.search_files(self.directory, [], [], query, jobs=2, max_count=max_count),
+                                     expected)
+
+
+class TestCombinePatterns(unittest.TestCase):
+
+    def test_inline_global_flags_are_not_merged(self):
+        """インラインのグローバルフラグを持つパターンが他のパターンに影響しないかテスト"""
+        content = 'FOO upper\nfoo lower\nqux\n'
+        query = search.SearchQuery([], ['foo', '(?i)QUX'], use_regex=True)
+        self.assertIsNone(search._combine_patterns(['foo', '(?i)QUX'], 0))
+        self.assertEqual(list(search.find_match_locations(content, query)), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
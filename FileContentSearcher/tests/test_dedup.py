@@ -0,0 +1,76 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def search(self, jobs, dedup, policy=None):
+        query = search.SearchQuery(['needle'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            return search.search_files(self.directory, [], [], query, jobs=jobs, dedup=dedup, policy=policy)
+
+    def test_identical_bytes_searched_differently(self):
+        """同じ内容でも検索方法が違うファイル (圧縮ファイルとそのコピー) の結果を共有しないかテスト"""
+        with gzip.open(self.path('a.gz'), 'wt') as f:
+            f.write('needle in gz\n')
+        shutil.copy(self.path('a.gz'), self.path('b.gzcopy'))
+        with zipfile.ZipFile(self.path('c.zip'), 'w') as archive:
+            archive.writestr('inner.txt', 'needle in zip\n')
+        shutil.copy(self.path('c.zip'), self.path('d.bin'))
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                self.assertEqual(self.search(jobs, dedup=True), self.search(jobs, dedup=False))
+                self.assertEqual(self.search(jobs, dedup=True)[self.path('a.gz')], {1: 'needle in gz'})
+
+    def test_copies_are_all_reported(self):
+        """内容が同じファイルはすべて同じ結果で報告されるかテスト"""
+        for name in ('a.txt', 'b.txt', 'c.log'):
+            with open(self.path(name), 'w') as f:
+                f.write('hay\nneedle\n')
+        with gzip.open(self.path('a.txt.gz'), 'wt') as f:
+            f.write('needle\n')
+        shutil.copy(self.path('a.txt.gz'), self.path('b.txt.gz'))
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                results = self.search(jobs, dedup=True)
+                self.assertEqual(results, self.search(jobs, dedup=False))
+                self.assertEqual(len(results), 5)
+
+    def test_policy_applies_before_hashing(self):
+        """並列検索でもポリシーで除外するファイルは重複判定のために読まないかテスト"""
+        for name in ('a.img', 'b.img', 'big1.txt', 'big2.txt'):
+            with open(self.path(name), 'wb') as f:
+                f.write(b'\0' * 512 if name.endswith('.img') else b'needle\n' * 4096)
+        for name in ('c.txt', 'd.txt'):
+            with open(self.path(name), 'w') as f:
+                f.write('needle\n')
+        policy = search.FilePolicy(max_filesize=1024, skip_binary=True, rules=())
+        with mock.patch.object(search, '_group_copies', wraps=search._group_copies) as group_copies:
+            results = self.search(2, dedup=True, policy=policy)
+        self.assertEqual(sorted(results), [self.path('c.txt'), self.path('d.txt')])
+        self.assertEqual(sorted(group_copies.call_args.args[0]), [self.path('c.txt'), self.path('d.txt')])
+
+
+if __name__ == '__main__':
+    unittest.main()
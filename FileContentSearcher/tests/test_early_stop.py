@@ -0,0 +1,43 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestEarlyStop(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Every line matches, so each result is far larger than a pipe buffer.
+        for i in range(16):
+            with open(os.path.join(self.directory, f'f{i:02}.log'), 'w') as f:
+                f.write(''.join(f'needle {i} line {n} {"x" * 30}\n' for n in range(20000)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parallel_max_files_with_large_results(self):
+        """大きな結果を送っている途中のワーカーがいても、--max-files の並列検索が終了するかテスト"""
+        process = subprocess.Popen([sys.executable, search.__file__, self.directory, '--and', 'needle',
+                                    '-j', '4', '--max-files', '1', '--jsonl'],
+                                   stdout=subprocess.PIPE, text=True, start_new_session=True)
+        try:
+            output, _ = process.communicate(timeout=60)
+        except subprocess.TimeoutExpired:
+            # Takes the pool workers down too.
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            self.fail("the search did not finish")
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(len(output.splitlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestArchiveMembers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with zipfile.ZipFile(self.path('a.zip'), 'w') as archive:
+            archive.writestr('notes.txt', 'needle in text\n')
+            archive.writestr('image.bin', b'needle\x00\x01\x02\n')
+            archive.writestr('doc.pdf', b'%PDF-1.7\nneedle\n')
+        with gzip.open(self.path('b.bin.gz'), 'wb') as f:
+            f.write(b'\x00\x00needle\n')
+        with gzip.open(self.path('c.txt.gz'), 'wb') as f:
+            f.write(b'needle in gz\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def search(self, query, policy, jobs=1, dedup=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return search.search_files(self.directory, [], [], query, jobs=jobs, dedup=dedup, policy=policy)
+
+    def test_binary_members_are_skipped(self):
+        """アーカイブのメンバーや圧縮ファイルの中身もバイナリ判定されるかテスト"""
+        queries = [search.SearchQuery(['needle']), search.SearchQuery(['needle'], as_bytes=True),
+                   search.QueryBatch({'q': search.SearchQuery(['needle'])}),
+                   search.QueryBatch({'q': search.SearchQuery(['needle'], as_bytes=True)}, as_bytes=True)]
+        skip = search.FilePolicy(None, True, ())
+        for query in queries:
+            for jobs, dedup in ((1, False), (2, False), (2, True)):
+                with self.subTest(query=type(query).__name__, as_bytes=query.as_bytes, jobs=jobs, dedup=dedup):
+                    results = self.search(query, skip, jobs, dedup)
+                    self.assertEqual(sorted(results), [self.path('a.zip!notes.txt'), self.path('c.txt.gz')])
+
+    def test_text_policy_searches_binary_members(self):
+        """--binary-files text や text のタイプポリシーではバイナリのメンバーも検索するかテスト"""
+        query = search.SearchQuery(['needle'])
+        everything = [self.path('a.zip!doc.pdf'), self.path('a.zip!image.bin'), self.path('a.zip!notes.txt'),
+                      self.path('b.bin.gz'), self.path('c.txt.gz')]
+        self.assertEqual(sorted(self.search(query, search.FilePolicy(None, False, ()))), everything)
+        self.assertEqual(sorted(self.search(query, None)), everything)
+        policy = search.FilePolicy(None, True, search.FilePolicy.parse_rules('*.zip=text'))
+        self.assertEqual(sorted(self.search(query, policy)), everything[:3] + everything[4:])
+
+
+if __name__ == '__main__':
+    unittest.main()
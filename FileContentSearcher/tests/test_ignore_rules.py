@@ -0,0 +1,132 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+# (.gitignore の行, 相対パス, ディレクトリか, 除外されるか) — git check-ignore と同じ結果
+PATTERN_CASES = [
+    ('*.log', 'a.log', False, True),
+    ('*.log', 'd/a.log', False, True),
+    ('*.log', 'a.logx', False, False),
+    ('/build', 'build', True, True),
+    ('/build', 'd/build', True, False),
+    ('doc/*.txt', 'doc/a.txt', False, True),
+    ('doc/*.txt', 'doc/x/a.txt', False, False),
+    ('doc/*.txt', 'x/doc/a.txt', False, False),
+    ('**/cache', 'cache', True, True),
+    ('**/cache', 'a/b/cache', True, True),
+    ('logs/**', 'logs/a', False, True),
+    ('logs/**', 'logs/a/b', False, True),
+    ('logs/**', 'logs', True, False),
+    ('a/**/b', 'a/b', False, True),
+    ('a/**/b', 'a/x/y/b', False, True),
+    ('a/**/b', 'xa/b', False, False),
+    ('tmp/', 'tmp', True, True),
+    ('tmp/', 'tmp', False, False),
+    ('tmp/', 'x/tmp', True, True),
+    ('\\#hash', '#hash', False, True),
+    ('\\!bang', '!bang', False, True),
+    ('trail\\ ', 'trail ', False, True),
+    ('space   ', 'space', False, True),
+    ('[abc].txt', 'b.txt', False, True),
+    ('[abc].txt', 'd.txt', False, False),
+    ('[!a].txt', 'b.txt', False, True),
+    ('[!a].txt', 'a.txt', False, False),
+    ('[]x].c', '].c', False, True),
+    ('[]x].c', 'x.c', False, True),
+    ('a?c', 'abc', False, True),
+    ('a?c', 'a/c', False, False),
+    ('a\\*c', 'a*c', False, True),
+    ('a\\*c', 'abc', False, False),
+]
+
+
+def parse_rules(*lines):
+    return [(0,) + rule for rule in map(search._parse_ignore_line, lines) if rule is not None]
+
+
+class TestIgnorePatterns(unittest.TestCase):
+
+    def test_patterns(self):
+        """各パターンがgitと同じパスを除外するかテスト"""
+        for line, relpath, is_dir, expected in PATTERN_CASES:
+            with self.subTest(line=line, relpath=relpath, is_dir=is_dir):
+                self.assertEqual(search._is_ignored(parse_rules(line), relpath, is_dir), expected)
+
+    def test_blank_and_comment_lines(self):
+        """空行・コメント行・'/' だけの行が無視されるかテスト"""
+        for line in ('', '   ', '\n', '# comment', '#', '/', '!'):
+            with self.subTest(line=line):
+                self.assertIsNone(search._parse_ignore_line(line))
+
+    def test_last_matching_rule_wins(self):
+        """否定パターンは後に書かれたものが優先されるかテスト"""
+        rules = parse_rules('*.log', '!keep.log')
+        self.assertTrue(search._is_ignored(rules, 'other.log', False))
+        self.assertFalse(search._is_ignored(rules, 'keep.log', False))
+        rules = parse_rules('!keep.log', '*.log')
+        self.assertTrue(search._is_ignored(rules, 'keep.log', False))
+
+    def test_negated_directory_only_rule(self):
+        """ディレクトリ限定の否定パターンがファイルには効かないかテスト"""
+        rules = parse_rules('out*', '!out/')
+        self.assertFalse(search._is_ignored(rules, 'out', True))
+        self.assertTrue(search._is_ignored(rules, 'out', False))
+
+
+class TestWalk(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for relpath in ('a.txt', 'a.log', 'keep.log', 'build/out.txt', 'src/main.py', 'src/only.txt',
+                        'src/lib/only.txt', 'src/lib/x.tmp', 'node_modules/pkg/index.js',
+                        'src/node_modules/dep.js', '.git/config'):
+            path = os.path.join(self.directory, *relpath.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('x\n')
+        with open(os.path.join(self.directory, '.gitignore'), 'w') as f:
+            f.write('# root rules\n*.log\n!keep.log\n/build/\n*.tmp\n')
+        with open(os.path.join(self.directory, 'src', '.gitignore'), 'w') as f:
+            f.write('/only.txt\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def collect(self, exclude_dirs=(), ignore_files=()):
+        paths = search._collect_files(self.directory, [], [], exclude_dirs, ignore_files)
+        return sorted(os.path.relpath(path, self.directory).replace(os.sep, '/') for path in paths)
+
+    def test_ignore_files(self):
+        """ルートとサブディレクトリの .gitignore が適用されるかテスト"""
+        self.assertEqual(self.collect(exclude_dirs=['.git', 'node_modules'], ignore_files=['.gitignore']), [
+            '.gitignore', 'a.txt', 'keep.log', 'src/.gitignore', 'src/lib/only.txt', 'src/main.py',
+        ])
+
+    def test_exclude_dir(self):
+        """--exclude-dir が名前のパターンでどの階層のディレクトリも除外するかテスト"""
+        self.assertEqual(self.collect(exclude_dirs=['.git', 'node_*', 'li?']), [
+            '.gitignore', 'a.log', 'a.txt', 'build/out.txt', 'keep.log', 'src/.gitignore', 'src/main.py',
+            'src/only.txt',
+        ])
+
+    def test_pruned_directories_are_not_read(self):
+        """除外したディレクトリの中身を読みに行かないかテスト"""
+        with mock.patch.object(search.os, 'scandir', wraps=os.scandir) as scandir:
+            self.collect(exclude_dirs=['node_modules'], ignore_files=['.gitignore'])
+        scanned = {os.path.relpath(call.args[0], self.directory).replace(os.sep, '/')
+                   for call in scandir.call_args_list}
+        self.assertNotIn('build', scanned)
+        self.assertNotIn('node_modules', scanned)
+        self.assertNotIn('src/node_modules', scanned)
+        self.assertIn('src/lib', scanned)
+
+
+if __name__ == '__main__':
+    unittest.main()
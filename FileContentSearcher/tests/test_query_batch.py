@@ -0,0 +1,48 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestQueryBatchArchives(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_members_read_once_for_all_queries(self):
+        """--bytes のクエリ一括検索でもアーカイブを一度だけ展開し、クエリごとの検索と同じ結果になるかテスト"""
+        archive_path = os.path.join(self.directory, 'a.zip')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            archive.writestr('one.txt', 'needle\r\nHay\rforbidden\n')
+            archive.writestr('two.txt', 'hay\nneedle 42\n')
+        gz_path = os.path.join(self.directory, 'b.txt.gz')
+        with gzip.open(gz_path, 'wb') as f:
+            f.write(b'hay\r\nneedle\n')
+        specs = {'and': (['needle'], [], []), 'not': (['needle'], [], ['forbidden']),
+                 'case': ([], ['HAY'], [], False, True), 'regex': (['\\d+$'], [], [], True)}
+        batch = search.QueryBatch({name: search.SearchQuery(*spec[:3], *spec[3:], as_bytes=True)
+                                   for name, spec in specs.items()}, as_bytes=True)
+        for path in (archive_path, gz_path):
+            for max_count in (None, 1):
+                expected = {name: search.search_in_archive(path, query.text_query, max_count)
+                            for name, query in batch.queries.items()}
+                with self.subTest(path=path, max_count=max_count), \
+                        mock.patch.object(search, '_iter_streams', wraps=search._iter_streams) as iter_streams:
+                    self.assertEqual(batch.search_file(path, max_count=max_count),
+                                     {name: locations for name, locations in expected.items() if locations})
+                    self.assertEqual(iter_streams.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
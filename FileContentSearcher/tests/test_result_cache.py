@@ -0,0 +1,119 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = tempfile.mkdtemp()
+        for i in range(6):
+            self.write(f'f{i}.txt', 'hay\n' * i + f'needle {i}\n' + ('forbidden\n' if i == 3 else ''))
+        with zipfile.ZipFile(os.path.join(self.directory, 'a.zip'), 'w') as archive:
+            archive.writestr('inner.txt', 'hay\nneedle in zip\n')
+        with gzip.open(os.path.join(self.directory, 'b.txt.gz'), 'wt') as f:
+            f.write('needle in gz\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.cache_directory)
+
+    def write(self, name, text, mtime_ns=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def search(self, query, result_cache=None, jobs=1, max_count=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return search.search_files(self.directory, [], [], query, jobs=jobs, max_count=max_count,
+                                       result_cache=result_cache)
+
+    def test_invalidation_key(self):
+        """キャッシュした結果がファイルの更新時刻・サイズとクエリの指紋が同じ場合にだけ使われるかテスト"""
+        query = search.SearchQuery(['needle'], [], ['forbidden'])
+        path = os.path.join(self.directory, 'f1.txt')
+        stat = os.stat(path)
+        cache = search.ResultCache(self.cache_directory, query)
+        cache.put(path, stat, {2: 'needle 1'})
+        self.assertEqual(cache.get(path, stat), {2: 'needle 1'})
+
+        self.write('f1.txt', 'hay\nneedle 1\n', stat.st_mtime_ns + 10 ** 9)
+        self.assertIsNone(cache.get(path, os.stat(path)))
+        self.write('f1.txt', 'hay\nneedle 1 and more\n', stat.st_mtime_ns)
+        self.assertIsNone(cache.get(path, os.stat(path)))
+        self.write('f1.txt', 'hay\nneedle 1\n', stat.st_mtime_ns)
+        self.assertEqual(cache.get(path, os.stat(path)), {2: 'needle 1'})
+
+        same = [search.ResultCache(self.cache_directory, search.SearchQuery(['needle'], [], ['forbidden'])),
+                search.ResultCache(self.cache_directory, search.SearchQuery(['needle'], [], ['forbidden']),
+                                   max_count=None)]
+        different = [search.ResultCache(self.cache_directory, search.SearchQuery(['needle'])),
+                     search.ResultCache(self.cache_directory, search.SearchQuery([], ['needle'], ['forbidden'])),
+                     search.ResultCache(self.cache_directory, query, max_count=1),
+                     search.ResultCache(self.cache_directory, search.SearchQuery(['needle'], [], ['forbidden'],
+                                                                                 ignore_case=True)),
+                     search.ResultCache(self.cache_directory, search.SearchQuery(['needle'], [], ['forbidden'],
+                                                                                 use_regex=True)),
+                     search.ResultCache(self.cache_directory, search.SearchQuery(['needle'], [], ['forbidden'],
+                                                                                 as_bytes=True))]
+        for other in same:
+            self.assertEqual(other.get(path, stat), {2: 'needle 1'})
+        for other in different:
+            with self.subTest(fingerprint=other.fingerprint):
+                self.assertIsNone(other.get(path, stat))
+        reordered = search.SearchQuery(['b', 'a'], ['d', 'c'])
+        self.assertEqual(reordered.fingerprint(), search.SearchQuery(['a', 'b'], ['c', 'd']).fingerprint())
+
+    def test_cached_results_match_uncached(self):
+        """キャッシュを使った検索の結果がキャッシュなしの検索と同じで、変更のないファイルは再検索しないかテスト"""
+        queries = [search.SearchQuery(['needle'], [], ['forbidden']),
+                   search.SearchQuery(['needle \\d'], use_regex=True),
+                   search.SearchQuery([], ['needle', 'zzz'], as_bytes=True)]
+        for query in queries:
+            for jobs in (1, 2):
+                for max_count in (None, 1):
+                    with self.subTest(patterns=query.all_patterns, as_bytes=query.as_bytes, jobs=jobs,
+                                      max_count=max_count):
+                        expected = self.search(query, jobs=jobs, max_count=max_count)
+                        self.assertTrue(expected)
+                        cache = search.ResultCache(self.cache_directory, query, max_count)
+                        self.assertEqual(self.search(query, cache, jobs, max_count), expected)
+                        # Every file is unchanged, so the second run only reads the cache.
+                        with mock.patch.object(search, 'search_in_text', side_effect=AssertionError), \
+                                mock.patch.object(search, 'search_in_bytes', side_effect=AssertionError), \
+                                mock.patch.object(search, 'search_in_archive', side_effect=AssertionError):
+                            self.assertEqual(self.search(query, cache, 1, max_count), expected)
+
+    def test_changed_file_is_searched_again(self):
+        """変更されたファイルだけが再検索され、結果に反映されるかテスト"""
+        query = search.SearchQuery(['needle'], [], ['forbidden'])
+        cache = search.ResultCache(self.cache_directory, query)
+        self.search(query, cache)
+        stat = os.stat(os.path.join(self.directory, 'f2.txt'))
+        changed = self.write('f2.txt', 'forbidden needle\n', stat.st_mtime_ns + 10 ** 9)
+        added = self.write('new.txt', 'a needle\n')
+        with mock.patch.object(search, 'search_in_text', wraps=search.search_in_text) as search_in_text:
+            results = self.search(query, cache)
+        self.assertEqual(sorted(call.args[0] for call in search_in_text.call_args_list), [changed, added])
+        self.assertEqual(results, self.search(query))
+        self.assertNotIn(changed, results)
+        self.assertIn(added, results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import openpyxl
+
+import search
+
+REQUESTS = [
+    {"and": ["needle"]},
+    {"or": ["hay", "needle\\d"], "regex": True, "not": ["forbidden"]},
+    {"and": ["needle"], "max_count": 1, "include": ["*.txt"]},
+    {"queries": {"a": {"and": ["needle"]}, "b": {"or": ["\\d+"], "regex": True}}},
+]
+
+
+class TestSearchServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for i in range(40):
+            with open(os.path.join(self.directory, f'f{i}.txt'), 'w') as f:
+                f.write('hay\n' * i + f'needle{i}\n' + ('forbidden\n' if i % 4 == 0 else ''))
+        workbook = openpyxl.Workbook()
+        workbook.active['A1'] = 'needle in a workbook'
+        self.workbook = os.path.join(self.directory, 'book.xlsx')
+        workbook.save(self.workbook)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pool(self, workers):
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=search._init_worker,
+                                       initargs=(None, None, None, None, None, multiprocessing.Event()))
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def expected(self, request):
+        if request.get("queries"):
+            query = search._parse_queries(request["queries"])
+        else:
+            query = search.SearchQuery(request.get("and"), request.get("or"), request.get("not"),
+                                       use_regex=request.get("regex", False))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return search.search_files(self.directory, request.get("include", []), [], query,
+                                       max_count=request.get("max_count"), policy=search.FilePolicy(None, True, ()))
+
+    def start_server(self, address, *options):
+        """Starts 'serve' on address and returns the process and a socket connected to it once it listens."""
+        process = subprocess.Popen([sys.executable, search.__file__, 'serve', self.directory, '--socket', address,
+                                    *options], stdout=subprocess.DEVNULL)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.terminate)
+        deadline = time.monotonic() + 30
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        while idle.connect_ex(address) != 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        return process, idle
+
+    def serve_and_search(self, address, idle_client=False):
+        _, idle = self.start_server(address)
+        with idle:
+            if not idle_client:
+                idle.close()
+            old_timeout = socket.getdefaulttimeout()
+            socket.setdefaulttimeout(10)
+            try:
+                return dict(search.search_on_server(address, self.directory, {"and": ["needle"]}))
+            finally:
+                socket.setdefaulttimeout(old_timeout)
+
+    def test_concurrent_requests(self):
+        """複数のスレッドから同時に検索しても、通常の検索と同じ結果になるかテスト"""
+        for jobs, executor in ((1, None), (2, self.pool(2))):
+            server = search.SearchServer(self.directory, cache=search._MemoryWorkbookCache(), jobs=jobs,
+                                         executor=executor)
+            expected = [self.expected(request) for request in REQUESTS]
+            failures = []
+
+            def run(offset):
+                for i in range(8):
+                    index = (offset + i) % len(REQUESTS)
+                    if dict(server.search(REQUESTS[index])) != expected[index]:
+                        failures.append(index)
+
+            threads = [threading.Thread(target=run, args=(offset,)) for offset in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with self.subTest(jobs=jobs):
+                self.assertEqual(failures, [])
+
+    def test_worker_cache_stays_warm(self):
+        """プールのワーカーが検索の間もExcelのテキストをメモリ上に保持するかテスト"""
+        server = search.SearchServer(self.directory, cache=search._MemoryWorkbookCache(), jobs=2,
+                                     executor=self.pool(1))
+        self.assertEqual(list(dict(server.search({"and": ["workbook"]}))), [self.workbook])
+        # Unreadable now, but with the same size and mtime: only the cached text can still match.
+        stat = os.stat(self.workbook)
+        with open(self.workbook, 'wb') as f:
+            f.write(b'x' * stat.st_size)
+        os.utime(self.workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(list(dict(server.search({"and": ["needle in"]}))), [self.workbook])
+
+    def test_invalid_requests(self):
+        """不正なリクエストがクライアント向けのメッセージ付きの ValueError になるかテスト"""
+        server = search.SearchServer(self.directory)
+        cases = [
+            ({"or": []}, "query needs at least one 'and' or 'or' pattern"),
+            ({"and": "needle"}, "query: and/or/not must be lists of strings"),
+            ({"queries": {"a": {"or": []}}}, "query 'a' needs at least one 'and' or 'or' pattern"),
+            ({"and": ["("], "regex": True}, "Invalid regular expression"),
+            ({"and": ["needle"], "max_count": 0}, "max_count must be an integer of at least 1"),
+            ({"and": ["needle"], "max_files": 1.5}, "max_files must be an integer of at least 1"),
+            ({"and": ["needle"], "max_files": True}, "max_files must be an integer of at least 1"),
+            ({"and": ["needle"], "include": "*.txt"}, "include must be a list of strings"),
+            ({"and": ["needle"], "max_filesize": 10}, "max_filesize must be a string"),
+            ({"and": ["needle"], "binary_files": "maybe"}, "binary_files must be 'skip' or 'text'"),
+        ]
+        for request, message in cases:
+            with self.subTest(request=request):
+                with self.assertRaises(ValueError) as context:
+                    server.search(request)
+                self.assertIn(message, str(context.exception))
+        self.assertEqual(len(dict(server.search({"and": ["needle"], "max_files": 1, "max_count": 1}))), 1)
+
+    def test_unexpected_errors_reach_the_client(self):
+        """検索中の予期しないエラーがログに記録され、クライアントにエラーとして伝わるかテスト"""
+
+        def results():
+            yield os.path.join(self.directory, 'f1.txt'), {1: 'needle1'}
+            raise RuntimeError("broken during the search")
+
+        class FailingServer:
+            def search(self, request):
+                if request.get("early"):
+                    raise RuntimeError("broken before the search")
+                return results()
+
+        failing = FailingServer()
+        address = os.path.join(self.directory, 'server.sock')
+        server = socketserver.ThreadingUnixStreamServer(address, search._SearchRequestHandler)
+        server.daemon_threads = True
+        server.search_server = failing
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        log = io.StringIO()
+        with contextlib.redirect_stderr(log):
+            with self.assertRaisesRegex(ConnectionError, "broken during the search"):
+                list(search.search_on_server(address, self.directory, {"and": ["needle"]}))
+            with self.assertRaisesRegex(ValueError, "broken before the search"):
+                search.search_on_server(address, self.directory, {"and": ["needle"], "early": True})
+        self.assertIn("RuntimeError: broken during the search", log.getvalue())
+        self.assertIn("RuntimeError: broken before the search", log.getvalue())
+
+    def test_socket_path_is_not_a_socket(self):
+        """--socket に既存の通常ファイルを指定した場合、削除せずにエラーになるかテスト"""
+        path = os.path.join(self.directory, 'notes.txt')
+        with open(path, 'w') as f:
+            f.write('precious data\n')
+        result = subprocess.run([sys.executable, search.__file__, 'serve', self.directory, '--socket', path],
+                                capture_output=True, text=True, timeout=30)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('is not a socket', result.stdout)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'precious data\n')
+
+    def test_stale_socket_is_replaced(self):
+        """終了時に削除されなかったソケットは置き換えて起動するかテスト"""
+        address = os.path.join(self.directory, 'server.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(address)
+        results = self.serve_and_search(address)
+        self.assertEqual(results, self.expected({"and": ["needle"]}))
+
+    def test_client_prints_in_path_order(self):
+        """並列で検索するサーバーの結果も、通常の並列検索と同じくパス順に表示されるかテスト"""
+        address = os.path.join(self.directory, 'server.sock')
+        self.start_server(address, '-j', '3')[1].close()
+        command = [sys.executable, search.__file__, self.directory, '--and', 'needle']
+        local = subprocess.run(command + ['-j', '3'], capture_output=True, text=True, timeout=60)
+        for _ in range(3):
+            remote = subprocess.run(command + ['--server', address], capture_output=True, text=True, timeout=60)
+            self.assertEqual(remote.stdout, local.stdout)
+
+    def test_terminate_cleans_up(self):
+        """SIGTERM でもCtrl+Cと同じく後片付けをして終了するかテスト"""
+        address = os.path.join(self.directory, 'server.sock')
+        process, idle = self.start_server(address, '-j', '2')
+        idle.close()
+        process.terminate()
+        self.assertEqual(process.wait(timeout=30), 0)
+        self.assertFalse(os.path.exists(address))
+
+    def test_idle_client_does_not_block_others(self):
+        """リクエストを送らない接続があっても、他のクライアントの検索に答えるかテスト"""
+        results = self.serve_and_search(os.path.join(self.directory, 'server.sock'), idle_client=True)
+        self.assertEqual(results, self.expected({"and": ["needle"]}))
+
+
+if __name__ == '__main__':
+    unittest.main()
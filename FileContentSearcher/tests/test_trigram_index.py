@@ -0,0 +1,100 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+FILES = {
+    'needle.txt': 'hay\na needle here\n',
+    'upper.txt': 'A NEEDLE IN CAPITALS\n',
+    'needed.txt': 'what is needed\n',
+    'digits.txt': 'order 12345\n',
+    'plain.txt': 'just hay\n',
+}
+
+
+class TestTrigramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_directory = tempfile.mkdtemp()
+        for name, text in FILES.items():
+            self.write(name, text)
+        with zipfile.ZipFile(self.path('packed.zip'), 'w') as archive:
+            archive.writestr('inner.txt', 'needle inside\n')
+        self.index = search.TrigramIndex(os.path.join(self.index_directory, 'index.sqlite3'))
+        self.assertEqual(self.index.update(self.directory, [], []), (len(FILES) + 1, 0))
+
+    def tearDown(self):
+        self.index._connect().close()
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.index_directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, text, mtime_ns=None):
+        with open(self.path(name), 'w') as f:
+            f.write(text)
+        if mtime_ns is not None:
+            os.utime(self.path(name), ns=(mtime_ns, mtime_ns))
+
+    def candidates(self, query):
+        filepaths = search._collect_files(self.directory, [], [])
+        return sorted(os.path.basename(p) for p in self.index.candidates(filepaths, query))
+
+    def assert_same_results(self, query):
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = search.search_files(self.directory, [], [], query)
+            self.assertEqual(search.search_files(self.directory, [], [], query, index=self.index), expected)
+
+    def test_literal_regex_and_ignore_case(self):
+        """リテラル・正規表現・大文字小文字を無視する検索で候補が絞り込まれ、結果が変わらないかテスト"""
+        # Trigrams are case-folded, so case-sensitive searches get the capitalized file as a candidate too.
+        cases = [
+            (search.SearchQuery(['needle']), ['needle.txt', 'packed.zip', 'upper.txt']),
+            (search.SearchQuery(['NEEDLE'], ignore_case=True), ['needle.txt', 'packed.zip', 'upper.txt']),
+            (search.SearchQuery(['nee(dle|ded)'], use_regex=True),
+             ['needed.txt', 'needle.txt', 'packed.zip', 'upper.txt']),
+            (search.SearchQuery(['(?i)a needle'], use_regex=True), ['needle.txt', 'upper.txt']),
+            (search.SearchQuery([], ['needed', 'order'], ['hay']), ['digits.txt', 'needed.txt']),
+        ]
+        for query, expected in cases:
+            with self.subTest(patterns=query.all_patterns, regex=query.use_regex, ignore_case=query.ignore_case):
+                self.assertEqual(self.candidates(query), expected)
+                self.assert_same_results(query)
+
+    def test_files_changed_between_runs(self):
+        """前回の索引作成後に追加・変更・削除されたファイルも正しく扱われるかテスト"""
+        query = search.SearchQuery(['needle'])
+        stat = os.stat(self.path('plain.txt'))
+        self.write('added.txt', 'a new needle\n')
+        self.write('plain.txt', 'hay, then needle\n', stat.st_mtime_ns + 10 ** 9)
+        os.remove(self.path('needle.txt'))
+        self.assertEqual(self.candidates(query), ['added.txt', 'packed.zip', 'plain.txt', 'upper.txt'])
+        self.assert_same_results(query)
+        self.assertEqual(self.index.update(self.directory, [], []), (2, 1))
+        self.assertEqual(self.candidates(query), ['added.txt', 'packed.zip', 'plain.txt', 'upper.txt'])
+        self.assert_same_results(query)
+        self.assertEqual(self.index.update(self.directory, [], []), (0, 0))
+
+    def test_queries_without_trigrams(self):
+        """三文字組に分解できないパターンでは、すべてのファイルを検索するかテスト"""
+        everything = sorted([*FILES, 'packed.zip'])
+        queries = [search.SearchQuery(['\\d+'], use_regex=True), search.SearchQuery(['ay']),
+                   search.SearchQuery([], ['needle', '\\d{5}'], use_regex=True)]
+        for query in queries:
+            with self.subTest(patterns=query.all_patterns):
+                self.assertEqual(self.candidates(query), everything)
+                self.assert_same_results(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
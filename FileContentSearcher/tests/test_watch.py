@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import search
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        # Make sure the change is visible even on file systems with coarse mtimes.
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        return path
+
+    def test_polling_reports_changes_only(self):
+        """ポーリングでの監視で、結果が変わったファイルだけが再度報告されるかテスト"""
+        first = self.write('a.txt', 'needle\n')
+        self.write('b.txt', 'hay\n')
+        query = search.SearchQuery(['needle'])
+        with mock.patch.object(search._Inotify, 'open', return_value=None):
+            results = search.watch_files(self.directory, [], [], query, interval=0.01)
+            self.assertEqual(next(results), (first, {1: 'needle'}))
+            self.write('a.txt', 'needle\n')
+            second = self.write('b.txt', 'hay\nneedle\n')
+            self.assertEqual(next(results), (second, {2: 'needle'}))
+            self.write('a.txt', 'hay\nhay\nneedle\n')
+            self.assertEqual(next(results), (first, {3: 'needle'}))
+            results.close()
+
+    def test_import_without_unix_flags(self):
+        """os.O_NONBLOCK のない環境 (Windows) でも読み込めるかテスト"""
+        code = ("import os, sys; del os.O_NONBLOCK; sys.path.insert(0, sys.argv[1]); "
+                "import search; print(search._Inotify.IN_NONBLOCK_CLOEXEC >= 0)")
+        output = subprocess.run([sys.executable, '-c', code, os.path.dirname(search.__file__)],
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'True')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import openpyxl
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+import search
+
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+
+def write_package(path, sheet_data, shared_strings=None, styles=None, workbook_pr=''):
+    """最小限のxlsxパッケージを手書きのXMLから作成する"""
+    overrides = [
+        ('/xl/workbook.xml', 'spreadsheetml.sheet.main+xml'),
+        ('/xl/worksheets/sheet1.xml', 'spreadsheetml.worksheet+xml'),
+    ]
+    workbook_rels = [f'<Relationship Id="rId1" Type="{RELATIONSHIPS}/worksheet" Target="worksheets/sheet1.xml"/>']
+    if shared_strings is not None:
+        overrides.append(('/xl/sharedStrings.xml', 'spreadsheetml.sharedStrings+xml'))
+        workbook_rels.append(f'<Relationship Id="rId2" Type="{RELATIONSHIPS}/sharedStrings" Target="sharedStrings.xml"/>')
+    if styles is not None:
+        overrides.append(('/xl/styles.xml', 'spreadsheetml.styles+xml'))
+        workbook_rels.append(f'<Relationship Id="rId3" Type="{RELATIONSHIPS}/styles" Target="styles.xml"/>')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            + ''.join(f'<Override PartName="{part}" ContentType="application/vnd.openxmlformats-officedocument.{kind}"/>'
+                      for part, kind in overrides)
+            + '</Types>'))
+        archive.writestr('_rels/.rels', (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{PACKAGE}">'
+            f'<Relationship Id="rId1" Type="{RELATIONSHIPS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        archive.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="{MAIN}" xmlns:r="{RELATIONSHIPS}">'
+            f'{workbook_pr}<sheets><sheet name="Hand" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{PACKAGE}">'
+            + ''.join(workbook_rels) + '</Relationships>'))
+        if shared_strings is not None:
+            archive.writestr('xl/sharedStrings.xml', (
+                f'<?xml version="1.0" encoding="UTF-8"?><sst xmlns="{MAIN}">{shared_strings}</sst>'))
+        if styles is not None:
+            archive.writestr('xl/styles.xml', (
+                f'<?xml version="1.0" encoding="UTF-8"?><styleSheet xmlns="{MAIN}">{styles}</styleSheet>'))
+        archive.writestr('xl/worksheets/sheet1.xml', (
+            f'<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="{MAIN}"><sheetData>'
+            f'{sheet_data}</sheetData></worksheet>'))
+
+
+class TestXlsxReader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def assertSameAsOpenpyxl(self, filepath):
+        expected = list(search._iter_openpyxl_cells(filepath))
+        self.assertTrue(expected)
+        self.assertEqual(list(search._iter_xlsx_cells(filepath)), expected)
+
+    def test_values_written_by_openpyxl(self):
+        """文字列・数値・真偽値・数式・空のセルがopenpyxlと同じテキストになるかテスト"""
+        filepath = self.path('values.xlsx')
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = 'Values'
+        sheet.append(['text', 42, 3.5, -0.25, 1e20, True, False])
+        sheet.append(['=SUM(B1:C1)', '=IF(F1,"yes","no")', None, '日本語', ' padded ', 'x_x005F_y'])
+        sheet['H5'] = 'far away'
+        second = workbook.create_sheet('Second')
+        second['B2'] = 'second sheet'
+        second['C3'] = 0
+        workbook.save(filepath)
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_dates_and_times(self):
+        """日付・時刻・経過時間の書式がopenpyxlと同じ値になるかテスト"""
+        filepath = self.path('dates.xlsx')
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet['A1'] = datetime.datetime(2020, 6, 18, 13, 45, 30)
+        sheet['A2'] = datetime.date(1900, 2, 28)
+        sheet['A3'] = datetime.time(8, 30, 15)
+        sheet['A4'] = datetime.timedelta(hours=30, minutes=5)
+        sheet['A5'] = 44000.5
+        sheet['A5'].number_format = 'yyyy/mm/dd hh:mm'
+        sheet['A6'] = 1.75
+        sheet['A6'].number_format = '[h]:mm:ss'
+        sheet['A7'] = 12345
+        sheet['A7'].number_format = '"Day" 0'
+        sheet['A8'] = 0.5
+        sheet['A8'].number_format = 'h:mm AM/PM'
+        sheet['A9'] = 30
+        sheet['A9'].number_format = 'd-mmm'
+        workbook.save(filepath)
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_1904_epoch(self):
+        """1904年基準のブックで日付がopenpyxlと同じになるかテスト"""
+        filepath = self.path('mac.xlsx')
+        workbook = openpyxl.Workbook()
+        workbook.epoch = CALENDAR_MAC_1904
+        sheet = workbook.active
+        sheet['A1'] = datetime.datetime(2021, 1, 2, 3, 4, 5)
+        sheet['A2'] = 10
+        sheet['A2'].number_format = 'yyyy-mm-dd'
+        workbook.save(filepath)
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_cells_without_references(self):
+        """r属性のない行・セルの座標がopenpyxlと同じになるかテスト"""
+        filepath = self.path('noref.xlsx')
+        write_package(filepath, (
+            '<row><c t="inlineStr"><is><t>a</t></is></c><c><v>1</v></c></row>'
+            '<row r="3"><c r="B3"><v>2</v></c><c><v>3</v></c><c r="E3"><v>4</v></c><c><v>5</v></c></row>'
+            '<row><c><v>6</v></c></row>'
+        ))
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_strings_and_phonetic_runs(self):
+        """共有文字列・インライン文字列のリッチテキストとふりがなの扱いをテスト"""
+        filepath = self.path('strings.xlsx')
+        write_package(filepath, (
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c></row>'
+            '<row r="2"><c r="A2" t="inlineStr"><is><r><t>in</t></r><r><t>line</t></r>'
+            '<rPh sb="0" eb="1"><t>イン</t></rPh></is></c>'
+            '<c r="B2" t="str"><v>formula result</v></c><c r="C2" t="e"><v>#DIV/0!</v></c>'
+            '<c r="D2" t="b"><v>1</v></c></row>'
+        ), shared_strings=(
+            '<si><t>漢字</t><rPh sb="0" eb="2"><t>カンジ</t></rPh></si>'
+            '<si><r><t>rich </t></r><r><rPr><b/></rPr><t>text</t></r></si>'
+            '<si><t xml:space="preserve"> spaced </t></si>'
+        ))
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_custom_styles(self):
+        """スタイルシートの組み込み書式・独自書式による日付判定をテスト"""
+        filepath = self.path('styles.xlsx')
+        write_package(filepath, (
+            '<row r="1"><c r="A1" s="1"><v>43831</v></c><c r="B1" s="2"><v>1.5</v></c>'
+            '<c r="C1" s="3"><v>43831.25</v></c><c r="D1" s="4"><v>43831</v></c><c r="E1" s="5"><v>2.25</v></c></row>'
+        ), styles=(
+            '<numFmts count="3"><numFmt numFmtId="164" formatCode="[$-409]mmmm d, yyyy"/>'
+            '<numFmt numFmtId="165" formatCode="&quot;h&quot;0.00"/>'
+            '<numFmt numFmtId="166" formatCode="[mm]:ss"/></numFmts>'
+            '<cellXfs count="6"><xf numFmtId="0"/><xf numFmtId="14"/><xf numFmtId="46"/>'
+            '<xf numFmtId="164"/><xf numFmtId="165"/><xf numFmtId="166"/></cellXfs>'
+        ), workbook_pr='<workbookPr date1904="false"/>')
+        self.assertSameAsOpenpyxl(filepath)
+
+    def test_shared_formulas_fall_back_to_openpyxl(self):
+        """共有数式を含むブックは組み込みリーダーが諦め、openpyxlの結果になるかテスト"""
+        filepath = self.path('shared.xlsx')
+        write_package(filepath, (
+            '<row r="1"><c r="A1"><f t="shared" ref="A1:A2" si="0">B1*2</f><v>2</v></c><c r="B1"><v>1</v></c></row>'
+            '<row r="2"><c r="A2"><f t="shared" si="0"/><v>4</v></c><c r="B2"><v>2</v></c></row>'
+        ))
+        with self.assertRaises(search._UnsupportedWorkbook):
+            list(search._iter_xlsx_cells(filepath))
+        self.assertEqual(search._read_workbook_cells(filepath), list(search._iter_openpyxl_cells(filepath)))
+
+
+class TestSearchCells(unittest.TestCase):
+
+    CELLS = [('S', 'A1', 'bcd x'), ('S', 'A2', 'hello'), ('T', 'B1', 'abc'), ('T', 'B2', 'bcd abc')]
+
+    def expected(self, query, max_count=None):
+        """すべてのセルをまとめて条件判定した結果"""
+        hits = {p for p in query.all_patterns
+                if any(search.check_file_conditions(text, search.SearchQuery([p], use_regex=query.use_regex))
+                       for _, _, text in self.CELLS)}
+        if any(p in hits for p in query.not_patterns) or not query.is_satisfied(hits):
+            return {}
+        matching = {f"{sheet}:{cell}": text for sheet, cell, text in self.CELLS if query.matches_line(text)}
+        return dict(list(matching.items())[:max_count])
+
+    def test_pattern_both_positive_and_not(self):
+        """OR と NOT の両方にあるパターンが、OR が満たされた後のセルでも NOT として判定されるかテスト"""
+        queries = [
+            search.SearchQuery([], ['abc', 'bcd'], ['abc']),
+            search.SearchQuery(['bcd'], [], ['abc'], use_regex=True),
+            search.SearchQuery([], ['hello', 'ab.'], ['ab.'], use_regex=True),
+            search.SearchQuery([], ['bcd', 'hello'], ['zzz']),
+        ]
+        for query in queries:
+            for max_count in (None, 1):
+                with self.subTest(patterns=query.all_patterns, max_count=max_count):
+                    self.assertEqual(search._search_cells(self.CELLS, query, max_count),
+                                     self.expected(query, max_count))
+
+
+if __name__ == '__main__':
+    unittest.main()